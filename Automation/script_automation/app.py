@@ -1,6 +1,15 @@
 import os
+import re
+import gzip
+import json
+import time
+import html
+import signal
 import subprocess
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from flask_apscheduler import APScheduler
 from werkzeug.utils import secure_filename
 from datetime import datetime
@@ -8,6 +17,14 @@ import sqlite3
 import secrets
 import logging
 
+try:
+    import resource
+except ImportError:  # not available on Windows; resource limits are skipped there
+    resource = None
+# Limits are applied to the running child with prlimit (Linux), not in a preexec_fn,
+# which is unsafe in this threaded server.
+CAN_LIMIT_RESOURCES = resource is not None and hasattr(resource, 'prlimit')
+
 
 class Config:
     SCHEDULER_API_ENABLED = True
@@ -18,6 +35,37 @@ class Config:
     UPLOAD_FOLDER = 'scripts'
     ALLOWED_EXTENSIONS = {'py'}
 
+    SCRIPT_TIMEOUT = int(os.environ.get('SCRIPT_TIMEOUT', 300))
+    # Output beyond this many bytes per run is drained from the pipe but not logged.
+    LOG_MAX_BYTES_PER_RUN = int(os.environ.get('LOG_MAX_BYTES_PER_RUN', 10 * 1024 * 1024))
+    # Largest batch read from the script's pipe and appended to its log in one write.
+    LOG_READ_SIZE = 64 * 1024
+
+    # The log page shows the last LOG_TAIL_BYTES; older output is fetched LOG_PAGE_BYTES at a time.
+    LOG_TAIL_BYTES = 64 * 1024
+    LOG_PAGE_BYTES = 64 * 1024
+    LOG_POLL_INTERVAL = 1.0
+    LOG_KEEPALIVE_INTERVAL = 15
+
+    # Every run is indexed in LOG_INDEX_DB by (segment, offset, length). A script's active
+    # <script>.log is rotated to <script>.<seq>.log once it reaches LOG_SEGMENT_BYTES;
+    # rotated segments are gzipped (one gzip member per run, so a run is read without
+    # decompressing the ones before it) and only the newest LOG_KEEP_SEGMENTS are kept.
+    LOG_INDEX_DB = 'instance/logs.db'
+    LOG_SEGMENT_BYTES = int(os.environ.get('LOG_SEGMENT_BYTES', 16 * 1024 * 1024))
+    LOG_KEEP_SEGMENTS = int(os.environ.get('LOG_KEEP_SEGMENTS', 10))
+    LOG_COMPRESS_SEGMENTS = os.environ.get('LOG_COMPRESS_SEGMENTS', '1') == '1'
+    DASHBOARD_RUNS = 20
+
+    # At most this many scripts run at once across all jobs and chains; the rest queue.
+    EXECUTION_WORKERS = int(os.environ.get('EXECUTION_WORKERS', os.cpu_count() or 2))
+    # Default per-script limits (0 = none); a job can set its own when it is scheduled.
+    SCRIPT_CPU_SECONDS = int(os.environ.get('SCRIPT_CPU_SECONDS', 0))
+    SCRIPT_MEMORY_MB = int(os.environ.get('SCRIPT_MEMORY_MB', 0))
+
+    # Assumed run time of a script with no successful runs yet, when ordering pipeline nodes.
+    PIPELINE_DEFAULT_DURATION = 60.0
+
 
 app = Flask(__name__)
 app.config.from_object(Config())
@@ -34,6 +82,187 @@ if not os.path.exists('instance'):
     os.makedirs('instance')
 
 
+class LogIndex:
+    """SQLite index of script runs: where each run's output lives in the log segments."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        script TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        status TEXT NOT NULL,
+        exit_code INTEGER,
+        segment TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER,
+        dropped_bytes INTEGER NOT NULL DEFAULT 0,
+        member_offset INTEGER,
+        member_length INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS runs_script ON runs (script, id);
+    CREATE INDEX IF NOT EXISTS runs_segment ON runs (segment);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(self.SCHEMA)
+            columns = {row['name'] for row in db.execute("PRAGMA table_info(runs)")}
+            for column in ('member_offset', 'member_length'):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE runs ADD COLUMN {column} INTEGER")
+            # Runs still marked running were cut off by a restart.
+            db.execute("UPDATE runs SET status = 'interrupted' WHERE status = 'running'")
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def query(self, sql, params=()):
+        db = self.connect()
+        try:
+            with db:
+                return [dict(row) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def execute(self, sql, params=()):
+        db = self.connect()
+        try:
+            with db:
+                return db.execute(sql, params).lastrowid
+        finally:
+            db.close()
+
+    def start_run(self, script, segment, offset):
+        return self.execute(
+            "INSERT INTO runs (script, started_at, status, segment, offset) VALUES (?, ?, 'running', ?, ?)",
+            (script, time.time(), segment, offset))
+
+    def finish_run(self, run_id, status, exit_code, length, dropped_bytes):
+        self.execute(
+            "UPDATE runs SET finished_at = ?, status = ?, exit_code = ?, length = ?, dropped_bytes = ? WHERE id = ?",
+            (time.time(), status, exit_code, length, dropped_bytes, run_id))
+
+    def get(self, run_id):
+        rows = self.query("SELECT * FROM runs WHERE id = ?", (run_id,))
+        return rows[0] if rows else None
+
+    def average_durations(self, scripts):
+        """Mean wall time of each script's successful runs, for the scripts that have any."""
+        placeholders = ','.join('?' * len(scripts))
+        rows = self.query(
+            f"SELECT script, AVG(finished_at - started_at) AS duration FROM runs "
+            f"WHERE status = 'success' AND script IN ({placeholders}) GROUP BY script", tuple(scripts))
+        return {row['script']: row['duration'] for row in rows}
+
+    def recent(self, script=None, limit=20):
+        if script:
+            return self.query("SELECT * FROM runs WHERE script = ? ORDER BY id DESC LIMIT ?", (script, limit))
+        return self.query("SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,))
+
+    def segment_runs(self, segment):
+        return self.query("SELECT id, offset FROM runs WHERE segment = ? ORDER BY offset", (segment,))
+
+    def next_offset(self, run):
+        """Where the run after `run` starts in the same segment, or None if it is the last."""
+        rows = self.query("SELECT MIN(offset) AS offset FROM runs WHERE segment = ? AND offset > ?",
+                          (run['segment'], run['offset']))
+        return rows[0]['offset']
+
+    def move_segment(self, old, new, members=None):
+        """Point the runs of segment `old` at `new`; `members` maps run id -> (offset, length) of its gzip member."""
+        db = self.connect()
+        try:
+            with db:
+                db.execute("UPDATE runs SET segment = ? WHERE segment = ?", (new, old))
+                db.executemany("UPDATE runs SET member_offset = ?, member_length = ? WHERE id = ?",
+                               [(offset, length, run_id) for run_id, (offset, length) in (members or {}).items()])
+        finally:
+            db.close()
+
+    def drop_segment(self, segment):
+        self.execute("DELETE FROM runs WHERE segment = ?", (segment,))
+
+    def drop_script(self, script):
+        self.execute("DELETE FROM runs WHERE script = ?", (script,))
+
+
+class ExecutionPool:
+    """Runs scripts on at most `max_workers` threads, shared by every job; the rest queue.
+
+    Runs submitted with the same `key` (the script name) run one at a time: later ones
+    wait in a per-key backlog and are only handed to the executor when the previous one
+    finishes, so they never hold a worker while they wait.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='script')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        # Queue waits of the most recent runs, in seconds.
+        self.waits = deque(maxlen=100)
+        # key -> runs waiting behind the one with that key already queued or running.
+        self.backlogs = {}
+
+    def submit(self, fn, *args, key=None):
+        entry = (fn, args, Future(), time.time())
+        with self.lock:
+            self.queued += 1
+            if key is not None:
+                if key in self.backlogs:
+                    self.backlogs[key].append(entry)
+                    return entry[2]
+                self.backlogs[key] = deque()
+        self.executor.submit(self.run, entry, key)
+        return entry[2]
+
+    def run(self, entry, key):
+        fn, args, future, submitted = entry
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.waits.append(time.time() - submitted)
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            following = None
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                if key is not None:
+                    if self.backlogs[key]:
+                        following = self.backlogs[key].popleft()
+                    else:
+                        del self.backlogs[key]
+            if following:
+                self.executor.submit(self.run, following, key)
+
+    def stats(self):
+        with self.lock:
+            waits = list(self.waits)
+            return {
+                'max_workers': self.max_workers,
+                'running': self.running,
+                'queued': self.queued,
+                'completed': self.completed,
+                'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait': max(waits, default=0.0),
+            }
+
+
+log_index = LogIndex(app.config['LOG_INDEX_DB'])
+execution_pool = ExecutionPool(app.config['EXECUTION_WORKERS'])
+
+
 scheduler = APScheduler()
 scheduler.init_app(app)
 scheduler.start()
@@ -66,61 +295,357 @@ def validate_cron_expression(minute, hour, day, month, day_of_week):
             validate_field(month, 1, 12) and
             validate_field(day_of_week, 0, 6))
 
-def run_script_job(script_name, chain_scripts=None, chain_mode='sequential'):
-    with app.app_context():
-        def execute_script(script):
-            script_path = os.path.join(app.config['UPLOAD_FOLDER'], script)
-            log_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{script}.log")
+class RunOutput:
+    """Appends one run's output to its log as it arrives, keeping at most `max_bytes`."""
 
-            logger.info(f"Running script: {script_path}")
-            try:
-                result = subprocess.run(
-                    ['python', script_path],
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                    timeout=300
-                )
-                output = f"SUCCESS: {script} completed successfully\n{result.stdout}"
-                if result.stderr:
-                    output += f"\nWARNINGS:\n{result.stderr}"
-            except subprocess.CalledProcessError as e:
-                output = f"ERROR: Script '{script}' failed with exit code {e.returncode}\nSTDERR:\n{e.stderr}\nSTDOUT:\n{e.stdout}"
-                logger.error(f"Script {script} failed: {e}")
-            except subprocess.TimeoutExpired:
-                output = f"ERROR: Script '{script}' timed out after 5 minutes"
-                logger.error(f"Script {script} timed out")
-            except FileNotFoundError:
-                output = f"ERROR: Script '{script}' not found at path: {script_path}"
-                logger.error(f"Script {script} not found")
-            except Exception as e:
-                output = f"ERROR: Unexpected error running script '{script}': {str(e)}"
-                logger.error(f"Unexpected error running {script}: {e}")
+    def __init__(self, log_file, max_bytes):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, data):
+        room = self.max_bytes - self.written
+        if room > 0:
+            self.log_file.write(data[:room])
+            self.log_file.flush()
+            self.written += min(len(data), room)
+        self.dropped += max(0, len(data) - room)
+
+    def copy_from(self, pipe, read_size):
+        # read1 returns whatever is buffered (up to read_size), so a quiet script's
+        # lines reach the log right away and a chatty one is written in blocks.
+        while True:
+            data = pipe.read1(read_size)
+            if not data:
+                break
+            self.write(data)
+
+def archived_segments(script):
+    """Rotated segments of a script's log as (seq, file name), oldest first."""
+    pattern = re.compile(rf"^{re.escape(script)}\.(\d{{6}})\.log(\.gz)?$")
+    segments = []
+    for name in os.listdir(app.config['UPLOAD_FOLDER']):
+        match = pattern.match(name)
+        if match:
+            segments.append((int(match.group(1)), name))
+    return sorted(segments)
+
+def write_gzip_members(src, dst, offsets):
+    """Gzip `src` into `dst` as one member per range starting at each of `offsets` (sorted).
+
+    Returns the (offset, length) in `dst` of the member for each offset. The members
+    concatenate to a normal gzip file.
+    """
+    bounds = sorted(set(offsets))
+    if not bounds or bounds[0] > 0:
+        bounds.insert(0, 0)
+    spans = {}
+    for start, end in zip(bounds, bounds[1:] + [None]):
+        member_start = dst.tell()
+        with gzip.GzipFile(fileobj=dst, mode='wb') as member:
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = app.config['LOG_READ_SIZE'] if remaining is None else min(remaining, app.config['LOG_READ_SIZE'])
+                block = src.read(size)
+                if not block:
+                    break
+                member.write(block)
+                if remaining is not None:
+                    remaining -= len(block)
+        spans[start] = (member_start, dst.tell() - member_start)
+    return [spans[offset] for offset in offsets]
 
+def rotate_log(script):
+    """Retire the active log once it is LOG_SEGMENT_BYTES or more; prune the oldest segments."""
+    folder = app.config['UPLOAD_FOLDER']
+    active = f"{script}.log"
+    active_path = os.path.join(folder, active)
+    if log_size(active_path) < app.config['LOG_SEGMENT_BYTES']:
+        return
+
+    segments = archived_segments(script)
+    archived = f"{script}.{(segments[-1][0] + 1 if segments else 1):06d}.log"
+    os.rename(active_path, os.path.join(folder, archived))
+    members = None
+    if app.config['LOG_COMPRESS_SEGMENTS']:
+        runs = log_index.segment_runs(active)
+        with open(os.path.join(folder, archived), 'rb') as src, open(os.path.join(folder, archived + '.gz'), 'wb') as dst:
+            spans = write_gzip_members(src, dst, [run['offset'] for run in runs])
+        members = {run['id']: span for run, span in zip(runs, spans)}
+        os.remove(os.path.join(folder, archived))
+        archived += '.gz'
+    log_index.move_segment(active, archived, members)
+    segments.append((None, archived))
+    logger.info(f"Rotated log for {script} to {archived}")
+
+    for _, name in segments[:-app.config['LOG_KEEP_SEGMENTS']]:
+        os.remove(os.path.join(folder, name))
+        log_index.drop_segment(name)
+        logger.info(f"Pruned log segment {name}")
+
+def read_run_output(run):
+    """The bytes one run wrote, read with a single seek into its segment."""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], run['segment'])
+    if run['member_offset'] is not None:
+        # Compressed segment: the run's own gzip member holds exactly its range.
+        with open(path, 'rb') as f:
+            f.seek(run['member_offset'])
+            data = gzip.decompress(f.read(run['member_length']))
+        return data if run['length'] is None else data[:run['length']]
+
+    # Interrupted runs have no recorded length; they end where the next run starts or,
+    # for the last run, where the segment does.
+    length = run['length']
+    if length is None:
+        next_offset = log_index.next_offset(run)
+        if next_offset is not None:
+            length = next_offset - run['offset']
+        else:
+            length = app.config['LOG_MAX_BYTES_PER_RUN'] + app.config['LOG_PAGE_BYTES']
+    # Segments gzipped before runs had their own members can only be read from the
+    # start, so seeking into them decompresses everything up to the run.
+    opener = gzip.open if run['segment'].endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        f.seek(run['offset'])
+        return f.read(length)
+
+def resource_limits(limits):
+    """(resource, (soft, hard)) pairs for a script's CPU-time and memory limits."""
+    limits = limits or {}
+    cpu_seconds = limits.get('cpu_seconds') or app.config['SCRIPT_CPU_SECONDS']
+    memory_mb = limits.get('memory_mb') or app.config['SCRIPT_MEMORY_MB']
+    if not CAN_LIMIT_RESOURCES:
+        return []
+    pairs = []
+    if cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL a few seconds later if the script ignores it.
+        pairs.append((resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5)))
+    if memory_mb:
+        pairs.append((resource.RLIMIT_AS, (memory_mb * 1024 * 1024, memory_mb * 1024 * 1024)))
+    return pairs
+
+def apply_limits(pid, limits):
+    for limit, values in resource_limits(limits):
+        try:
+            resource.prlimit(pid, limit, values)
+        except ProcessLookupError:
+            return  # already exited
+
+def run_logged(script, script_path, log_file, timeout, limits=None):
+    """Run one script, streaming its output into `log_file` and recording the run in the index."""
+    offset = log_file.seek(0, os.SEEK_END)
+    run_id = log_index.start_run(script, f"{script}.log", offset)
+    log_file.write(f"--- Execution started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n".encode())
+    output = RunOutput(log_file, app.config['LOG_MAX_BYTES_PER_RUN'])
+    run_status, exit_code = 'error', None
+    try:
+        # stderr is merged into stdout so the log keeps the order the script wrote them in.
+        process = subprocess.Popen(
+            ['python', script_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        reader = threading.Thread(target=output.copy_from, args=(process.stdout, app.config['LOG_READ_SIZE']))
+        reader.start()
+        try:
+            apply_limits(process.pid, limits)
+        except Exception:
+            # Never leave the script running without its limits (or undrained and unreaped).
+            process.kill()
+            process.wait()
+            reader.join()
+            process.stdout.close()
+            raise
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            returncode = None
+        reader.join()
+        process.stdout.close()
+        exit_code = returncode
+
+        if returncode is None:
+            status = f"ERROR: Script '{script}' timed out after {timeout} seconds"
+            run_status = 'timeout'
+            logger.error(f"Script {script} timed out")
+        elif returncode < 0:
+            status = f"ERROR: Script '{script}' was killed by {signal.Signals(-returncode).name}"
+            run_status = 'failed'
+            logger.error(f"Script {script} was killed by signal {-returncode}")
+        elif returncode != 0:
+            status = f"ERROR: Script '{script}' failed with exit code {returncode}"
+            run_status = 'failed'
+            logger.error(f"Script {script} failed with exit code {returncode}")
+        else:
+            status = f"SUCCESS: {script} completed successfully"
+            run_status = 'success'
+    except FileNotFoundError:
+        status = f"ERROR: Script '{script}' not found at path: {script_path}"
+        logger.error(f"Script {script} not found")
+    except Exception as e:
+        status = f"ERROR: Unexpected error running script '{script}': {str(e)}"
+        logger.error(f"Unexpected error running {script}: {e}")
+
+    if output.dropped:
+        status = f"[output truncated: {output.dropped} bytes over the {output.max_bytes} byte limit not logged]\n{status}"
+    try:
+        log_file.write(f"\n{status}\n--- Execution completed at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n\n".encode())
+        log_file.flush()
+    except Exception as e:
+        logger.error(f"Failed to write log for {script}: {e}")
+    log_index.finish_run(run_id, run_status, exit_code, log_file.tell() - offset, output.dropped)
+    return run_status
+
+def execute_script(script, limits=None):
+    """Run one script with its output logged and indexed. Returns the run's status."""
+    script_path = os.path.join(app.config['UPLOAD_FOLDER'], script)
+    log_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{script}.log")
+    timeout = app.config['SCRIPT_TIMEOUT']
+
+    logger.info(f"Running script: {script_path}")
+    try:
+        rotate_log(script)
+        log_file = open(log_file_path, "ab")
+    except Exception as e:
+        logger.error(f"Failed to write log for {script}: {e}")
+        return 'error'
+    with log_file:
+        return run_logged(script, script_path, log_file, timeout, limits)
+
+def submit_script(script, limits=None):
+    """Queue one run on the shared pool. Runs of the same script append to the same log
+    segment, so the pool keeps them one at a time, keyed by script name."""
+    return execution_pool.submit(execute_script, script, limits, key=script)
+
+def parse_dependencies(text, scripts):
+    """Dependency graph from lines of "script.py: dependency.py, other.py".
+
+    Every script in `scripts` is a node; the ones never named before a colon have no
+    dependencies and start first.
+    """
+    dependencies = {script: [] for script in scripts}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        node, _, deps = line.partition(':')
+        node = node.strip()
+        if node not in dependencies:
+            raise ValueError(f"'{node}' is not one of the chained scripts")
+        for dep in deps.split(','):
+            dep = dep.strip()
+            if not dep:
+                continue
+            if dep not in dependencies:
+                raise ValueError(f"'{dep}' is not one of the chained scripts")
+            if dep not in dependencies[node]:
+                dependencies[node].append(dep)
+    validate_pipeline(dependencies)
+    return dependencies
+
+def validate_pipeline(dependencies):
+    """Raise ValueError unless every dependency is a node and the graph has no cycle."""
+    for node, deps in dependencies.items():
+        for dep in deps:
+            if dep not in dependencies:
+                raise ValueError(f"'{node}' depends on unknown script '{dep}'")
+    waiting = {node: set(deps) for node, deps in dependencies.items()}
+    while waiting:
+        ready = [node for node, deps in waiting.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle between: {', '.join(sorted(waiting))}")
+        for node in ready:
+            del waiting[node]
+        for deps in waiting.values():
+            deps.difference_update(ready)
+
+def remaining_path_lengths(dependencies, durations):
+    """Longest path, in expected seconds, from the start of each node to the end of the pipeline."""
+    dependents = {node: [] for node in dependencies}
+    for node, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].append(node)
+    lengths = {}
+
+    def visit(node):
+        if node not in lengths:
+            lengths[node] = (durations.get(node, app.config['PIPELINE_DEFAULT_DURATION'])
+                             + max((visit(child) for child in dependents[node]), default=0.0))
+        return lengths[node]
+
+    for node in dependencies:
+        visit(node)
+    return lengths
+
+def run_pipeline(dependencies, limits=None):
+    """Run a dependency graph of scripts: each starts once all its dependencies succeeded.
+
+    Nodes that become ready together are submitted longest remaining path first (from
+    the scripts' historical run times), so the critical path is never stuck behind
+    short branches. Dependents of a failed node are skipped.
+    """
+    durations = log_index.average_durations(list(dependencies))
+    lengths = remaining_path_lengths(dependencies, durations)
+    waiting = {node: set(deps) for node, deps in dependencies.items()}
+    running = {}
+    failed = []
+    skipped = []
+    started = time.time()
+
+    def skip_dependents(node):
+        for other, deps in list(waiting.items()):
+            if node in deps and other in waiting:
+                del waiting[other]
+                skipped.append(other)
+                skip_dependents(other)
+
+    logger.info(f"Pipeline started: {len(dependencies)} scripts, critical path ~{max(lengths.values(), default=0):.0f}s")
+    while waiting or running:
+        ready = sorted((node for node, deps in waiting.items() if not deps), key=lambda node: -lengths[node])
+        for node in ready:
+            del waiting[node]
+            running[submit_script(node, limits)] = node
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            node = running.pop(future)
             try:
-                with open(log_file_path, "a", encoding='utf-8') as log_file:
-                    log_file.write(f"--- Execution started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
-                    log_file.write(output)
-                    log_file.write(f"\n--- Execution completed at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n\n")
+                status = future.result()
             except Exception as e:
-                logger.error(f"Failed to write log for {script}: {e}")
+                logger.error(f"Pipeline script {node} raised: {e}")
+                status = 'error'
+            if status == 'success':
+                for deps in waiting.values():
+                    deps.discard(node)
+            else:
+                failed.append(node)
+                skip_dependents(node)
+
+    if skipped:
+        logger.warning(f"Pipeline skipped {', '.join(skipped)} after {', '.join(failed)} failed")
+    logger.info(f"Pipeline finished in {time.time() - started:.1f}s")
 
-        execute_script(script_name)
+def run_script_job(script_name, chain_scripts=None, chain_mode='sequential', limits=None, dependencies=None):
+    with app.app_context():
+        if chain_mode == 'dag' and dependencies:
+            run_pipeline(dependencies, limits)
+            return
+
+        # Every script goes through the shared pool, so however many chains fire at
+        # once, no more than EXECUTION_WORKERS interpreters run.
+        submit_script(script_name, limits).result()
         
         if chain_scripts:
             if chain_mode == 'parallel':
-                import threading
-                threads = []
-                for script in chain_scripts:
-                    thread = threading.Thread(target=execute_script, args=(script,))
-                    thread.start()
-                    threads.append(thread)
-                
-                for thread in threads:
-                    thread.join()
+                futures = [submit_script(script, limits) for script in chain_scripts]
+                for future in futures:
+                    future.result()
             else:
                 for script in chain_scripts:
-                    execute_script(script)
+                    submit_script(script, limits).result()
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -159,7 +684,9 @@ def dashboard():
             'trigger': str(job.trigger),
             'next_run_time': job.next_run_time,
             'chain_scripts': job.args[1] if len(job.args) > 1 and job.args[1] else None,
-            'chain_mode': job.args[2] if len(job.args) > 2 else None
+            'chain_mode': job.args[2] if len(job.args) > 2 else None,
+            'limits': job.args[3] if len(job.args) > 3 else None,
+            'dependencies': job.args[4] if len(job.args) > 4 else None
         }
         jobs.append(job_info)
 
@@ -183,7 +710,12 @@ def dashboard():
                         'modified': datetime.now()
                     })
 
-    return render_template('dashboard.html', jobs=jobs, scripts=scripts)
+    runs = log_index.recent(limit=app.config['DASHBOARD_RUNS'])
+    for run in runs:
+        run['started'] = datetime.fromtimestamp(run['started_at'])
+        run['duration'] = run['finished_at'] - run['started_at'] if run['finished_at'] else None
+
+    return render_template('dashboard.html', jobs=jobs, scripts=scripts, runs=runs, pool=execution_pool.stats())
 
 @app.route('/upload', methods=['POST'])
 def upload_script():
@@ -246,6 +778,24 @@ def schedule_job():
     chain_scripts = [s for s in chain_scripts if s and s != script_name]
     chain_scripts = list(dict.fromkeys(chain_scripts))
 
+    try:
+        limits = {
+            'cpu_seconds': int(request.form.get('cpu_seconds') or 0),
+            'memory_mb': int(request.form.get('memory_mb') or 0),
+        }
+    except ValueError:
+        flash('Resource limits must be whole numbers.', 'danger')
+        return redirect(url_for('dashboard'))
+    limits = {key: value for key, value in limits.items() if value > 0} or None
+
+    dependencies = None
+    if chain_mode == 'dag':
+        try:
+            dependencies = parse_dependencies(request.form.get('dependencies', ''), [script_name] + chain_scripts)
+        except ValueError as e:
+            flash(f'Invalid pipeline: {str(e)}', 'danger')
+            return redirect(url_for('dashboard'))
+
     cron_settings = {
         'every_5_min':   {'minute': '*/5', 'hour': '*', 'day': '*', 'month': '*', 'day_of_week': '*'},
         'every_15_min':  {'minute': '*/15', 'hour': '*', 'day': '*', 'month': '*', 'day_of_week': '*'},
@@ -306,7 +856,7 @@ def schedule_job():
         scheduler.add_job(
             id=job_id,
             func=run_script_job,
-            args=[script_name, chain_scripts if chain_scripts else None, chain_mode],
+            args=[script_name, chain_scripts if chain_scripts else None, chain_mode, limits, dependencies],
             trigger='cron',
             minute=cron['minute'],
             hour=cron['hour'],
@@ -319,7 +869,13 @@ def schedule_job():
         
         flash(f'Job "{job_id}" for script "{script_name}" scheduled successfully!', 'success')
         if chain_scripts:
-            chain_info = f"Chain: {' → '.join(chain_scripts)}" if chain_mode == 'sequential' else f"Chain: {' + '.join(chain_scripts)} (parallel)"
+            if chain_mode == 'dag':
+                chain_info = "Pipeline: " + "; ".join(
+                    f"{node} after {', '.join(deps)}" if deps else f"{node} first" for node, deps in dependencies.items())
+            elif chain_mode == 'sequential':
+                chain_info = f"Chain: {' → '.join(chain_scripts)}"
+            else:
+                chain_info = f"Chain: {' + '.join(chain_scripts)} (parallel)"
             flash(f'{chain_info}', 'info')
         
         logger.info(f"Job scheduled: {job_id} - {script_name} - {cron}")
@@ -366,23 +922,87 @@ def run_now(script_name):
         logger.error(f"Error running script {script_name}: {e}")
     return redirect(url_for('dashboard'))
 
+def log_path_for(script_name):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{secure_filename(script_name)}.log")
+
+def read_log_lines(log_file_path, start, end):
+    """Whole lines of a log between two byte offsets, as (start, end, text).
+
+    `start` moves forward to the next line boundary and `end` back to the last one, so
+    pages and live updates never split a line (or a UTF-8 character). A single line
+    longer than a page is returned as is.
+    """
+    with open(log_file_path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            data = f.read(end - start + 1)
+            previous, data = data[:1], data[1:]
+        else:
+            data = f.read(end)
+            previous = b'\n'
+    if previous != b'\n':
+        cut = data.find(b'\n')
+        if cut != -1:
+            start += cut + 1
+            data = data[cut + 1:]
+    cut = data.rfind(b'\n')
+    if cut != -1:
+        data = data[:cut + 1]
+    elif len(data) < app.config['LOG_PAGE_BYTES']:
+        data = b''
+    return start, start + len(data), data.decode('utf-8', errors='replace')
+
+def log_size(log_file_path):
+    try:
+        return os.path.getsize(log_file_path)
+    except OSError:
+        return 0
+
+def follow_log(log_file_path, offset):
+    """Server-sent events carrying whatever is appended to a log after `offset`.
+
+    Each event's id is the byte offset it ends at, so a reconnecting EventSource resumes
+    from Last-Event-ID without gaps or repeats.
+    """
+    last_event = time.time()
+    while True:
+        size = log_size(log_file_path)
+        if size < offset:
+            # The log was deleted or replaced; start over from its beginning.
+            offset = 0
+            yield "event: reset\ndata: {}\n\n"
+        if size > offset:
+            _, end, text = read_log_lines(log_file_path, offset, min(size, offset + app.config['LOG_PAGE_BYTES']))
+            if end > offset:
+                offset = end
+                last_event = time.time()
+                yield f"id: {offset}\ndata: {json.dumps(text)}\n\n"
+                continue
+        if time.time() - last_event > app.config['LOG_KEEPALIVE_INTERVAL']:
+            last_event = time.time()
+            yield ": keepalive\n\n"
+        time.sleep(app.config['LOG_POLL_INTERVAL'])
+
 @app.route('/view_log/<script_name>')
 def view_log(script_name):
     if not is_logged_in():
         return redirect(url_for('login'))
     
     script_name = secure_filename(script_name)
-    log_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{script_name}.log")
+    log_file_path = log_path_for(script_name)
     
+    notice = ''
+    size = log_size(log_file_path)
+    start = end = size
+    log_content = ''
     try:
-        with open(log_file_path, "r", encoding='utf-8') as f:
-            log_content = f.read()
+        start, end, log_content = read_log_lines(log_file_path, max(0, size - app.config['LOG_TAIL_BYTES']), size)
         if not log_content.strip():
-            log_content = f"Log file for '{script_name}' is empty. The script hasn't been executed yet or produced no output."
+            notice = f"Log file for '{script_name}' is empty. The script hasn't been executed yet or produced no output."
     except FileNotFoundError:
-        log_content = f"Log file for '{script_name}' not found. Run the script to generate logs."
+        notice = f"Log file for '{script_name}' not found. Run the script to generate logs."
     except Exception as e:
-        log_content = f"Error reading log file for '{script_name}': {str(e)}"
+        notice = f"Error reading log file for '{script_name}': {str(e)}"
     
     html_content = f"""
     <!DOCTYPE html>
@@ -395,6 +1015,7 @@ def view_log(script_name):
             .log-content {{ background: #1e1e1e; color: #f0f0f0; padding: 20px; border-radius: 8px; overflow-x: auto; }}
             .back-btn {{ background: #007bff; color: white; padding: 10px 15px; text-decoration: none; border-radius: 4px; }}
             .back-btn:hover {{ background: #0056b3; }}
+            .older-btn {{ background: #333; color: #f0f0f0; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }}
         </style>
     </head>
     <body>
@@ -402,14 +1023,94 @@ def view_log(script_name):
             <h1>📋 Log for: {script_name}</h1>
             <a href="{url_for('dashboard')}" class="back-btn">← Back to Dashboard</a>
         </div>
+        <div class="header">
+            <h3>Recent runs</h3>
+            {''.join(f'<div><a href="{url_for("run_log", run_id=run["id"])}" target="_blank">#{run["id"]}</a> '
+                     f'{datetime.fromtimestamp(run["started_at"]).strftime("%Y-%m-%d %H:%M:%S")} {run["status"]}</div>'
+                     for run in log_index.recent(script_name, limit=app.config['DASHBOARD_RUNS'])) or 'No runs recorded yet.'}
+        </div>
         <div class="log-content">
-            <pre>{log_content}</pre>
+            <button id="olderBtn" class="older-btn"{'' if start > 0 else ' hidden'}>Load older output</button>
+            <p id="notice">{html.escape(notice)}</p>
+            <pre id="log">{html.escape(log_content)}</pre>
         </div>
+        <script>
+            var logEl = document.getElementById('log');
+            var noticeEl = document.getElementById('notice');
+            var olderBtn = document.getElementById('olderBtn');
+            var oldest = {start};
+
+            olderBtn.addEventListener('click', function() {{
+                fetch('{url_for('log_range', script_name=script_name)}?end=' + oldest)
+                    .then(function(r) {{ return r.json(); }})
+                    .then(function(page) {{
+                        logEl.insertAdjacentText('afterbegin', page.text);
+                        oldest = page.start;
+                        olderBtn.hidden = oldest === 0;
+                    }});
+            }});
+
+            var source = new EventSource('{url_for('log_events', script_name=script_name)}?offset={end}');
+            source.onmessage = function(e) {{
+                var atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 20;
+                noticeEl.textContent = '';
+                logEl.append(JSON.parse(e.data));
+                if (atBottom) window.scrollTo(0, document.body.scrollHeight);
+            }};
+            source.addEventListener('reset', function() {{
+                logEl.textContent = '';
+                oldest = 0;
+                olderBtn.hidden = true;
+            }});
+        </script>
     </body>
     </html>
     """
     return html_content
 
+@app.route('/run_log/<int:run_id>')
+def run_log(run_id):
+    """The output of a single run, found through the index rather than by scanning the log."""
+    if not is_logged_in():
+        return redirect(url_for('login'))
+
+    run = log_index.get(run_id)
+    if not run:
+        return f"Run {run_id} not found", 404
+    try:
+        output = read_run_output(run)
+    except FileNotFoundError:
+        return f"The log segment for run {run_id} has been pruned", 404
+    return Response(output, mimetype='text/plain; charset=utf-8')
+
+@app.route('/log_range/<script_name>')
+def log_range(script_name):
+    """One page of a log: the whole lines in [start, end), at most LOG_PAGE_BYTES of them."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+
+    log_file_path = log_path_for(script_name)
+    size = log_size(log_file_path)
+    end = min(request.args.get('end', size, type=int), size)
+    start = max(0, request.args.get('start', end - app.config['LOG_PAGE_BYTES'], type=int), end - app.config['LOG_PAGE_BYTES'])
+    if start >= end:
+        return jsonify({'start': end, 'end': end, 'size': size, 'text': ''})
+    start, end, text = read_log_lines(log_file_path, start, end)
+    return jsonify({'start': start, 'end': end, 'size': size, 'text': text})
+
+@app.route('/log_events/<script_name>')
+def log_events(script_name):
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', log_size(log_path_for(script_name)), type=int)
+    response = Response(follow_log(log_path_for(script_name), max(0, offset)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/delete_script/<script_name>')
 def delete_script(script_name):
     if not is_logged_in():
@@ -435,6 +1136,9 @@ def delete_script(script_name):
 
         if os.path.exists(log_path):
             os.remove(log_path)
+        for _, segment in archived_segments(script_name):
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], segment))
+        log_index.drop_script(script_name)
 
         flash(f'Script "{script_name}" and its logs have been deleted successfully.', 'success')
         logger.info(f"Script deleted: {script_name}")
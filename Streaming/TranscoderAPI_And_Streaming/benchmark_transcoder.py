@@ -0,0 +1,186 @@
+"""Throughput benchmark for transcoder_api.py.
+
+Synthetic clips are generated with ffmpeg's lavfi sources (testsrc2 + sine) and pushed
+through /process/ in-process with FastAPI's TestClient. Every configuration runs in a
+fresh interpreter, so peak RSS is measured per configuration.
+
+    python benchmark_transcoder.py --durations 10,60 --resolutions 640x360,1280x720 \
+        --parallel 0,4 --output run.json
+    python benchmark_transcoder.py ... --compare run.json
+
+Peak RSS of the API process includes the TestClient's copy of the response body.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FRAME_RATE = 30
+# Keys that identify a configuration when comparing two runs.
+CONFIG_KEYS = ("duration", "resolution", "parallel", "concurrency")
+
+
+def generate_clip(path, duration, resolution):
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={FRAME_RATE}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", "-movflags", "+faststart",
+        path,
+    ], check=True)
+
+
+def run_single(config, result_file):
+    """Child process: transcode one clip `concurrency` times at once and write the result."""
+    os.environ["TRANSCODE_CACHE_MAX_BYTES"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fastapi.testclient import TestClient
+    import transcoder_api
+
+    client = TestClient(transcoder_api.app)
+    params = {"parallel": config["parallel"]}
+
+    def transcode_once(_):
+        with open(config["clip"], "rb") as f:
+            files = {"file": (os.path.basename(config["clip"]), f, "video/mp4")}
+            with client.stream("POST", "/process/", files=files, params=params) as r:
+                r.raise_for_status()
+                return sum(len(chunk) for chunk in r.iter_bytes())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        sizes = list(pool.map(transcode_once, range(config["concurrency"])))
+    wall = time.perf_counter() - start
+
+    media_seconds = config["duration"] * config["concurrency"]
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    result = {key: config[key] for key in CONFIG_KEYS}
+    result.update({
+        "wall_seconds": round(wall, 3),
+        "encode_fps": round(media_seconds * FRAME_RATE / wall, 2),
+        "realtime_factor": round(media_seconds / wall, 3),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale,
+        "peak_ffmpeg_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_scale,
+        "output_bytes": sizes[0],
+    })
+    with open(result_file, "w") as f:
+        json.dump(result, f)
+
+
+def host_info():
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (FileNotFoundError, IndexError):
+        ffmpeg = None
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+    }
+
+
+def run_matrix(args, work_dir):
+    results = []
+    clips = {}
+    matrix = itertools.product(args.durations, args.resolutions, args.parallel, args.concurrency)
+    for duration, resolution, parallel, concurrency in matrix:
+        if (duration, resolution) not in clips:
+            clip = os.path.join(work_dir, f"testsrc2_{resolution}_{duration}s.mp4")
+            print(f"Generating {clip}")
+            generate_clip(clip, duration, resolution)
+            clips[(duration, resolution)] = clip
+
+        config = {
+            "clip": clips[(duration, resolution)],
+            "duration": duration,
+            "resolution": resolution,
+            "parallel": parallel,
+            "concurrency": concurrency,
+        }
+        result_file = os.path.join(work_dir, "result.json")
+        print(f"Running {json.dumps({key: config[key] for key in CONFIG_KEYS})}")
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single", json.dumps(config), "--result-file", result_file],
+            capture_output=True, text=True,
+        )
+        if child.returncode != 0:
+            print(child.stdout[-2000:])
+            print(child.stderr[-2000:])
+            raise SystemExit(f"Benchmark run failed: {config}")
+        with open(result_file) as f:
+            result = json.load(f)
+        print(f"  {result['wall_seconds']}s wall, {result['encode_fps']} fps, "
+              f"{result['realtime_factor']}x realtime, {result['output_bytes']} bytes out")
+        results.append(result)
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """Print fps/wall deltas against a previous run; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = {tuple(r[key] for key in CONFIG_KEYS): r for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"\n{'configuration':<40} {'fps':>10} {'baseline':>10} {'change':>8}")
+    for result in results:
+        key = tuple(result[k] for k in CONFIG_KEYS)
+        label = " ".join(f"{k}={v}" for k, v in zip(CONFIG_KEYS, key))
+        old = baseline.get(key)
+        if old is None:
+            print(f"{label:<40} {result['encode_fps']:>10} {'-':>10} {'new':>8}")
+            continue
+        change = (result["encode_fps"] - old["encode_fps"]) / old["encode_fps"]
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{label:<40} {result['encode_fps']:>10} {old['encode_fps']:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcoder_api.py with synthetic clips")
+    parser.add_argument("--durations", type=int_list, default=[10, 60], help="clip durations in seconds")
+    parser.add_argument("--resolutions", type=lambda v: v.split(","), default=["640x360", "1280x720", "1920x1080"])
+    parser.add_argument("--parallel", type=int_list, default=[0], help="values for /process/?parallel=")
+    parser.add_argument("--concurrency", type=int_list, default=[1], help="simultaneous uploads per run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="fps drop that counts as a regression")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(json.loads(args.single), args.result_file)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="transcoder-bench-") as work_dir:
+        results = run_matrix(args, work_dir)
+
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": host_info(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
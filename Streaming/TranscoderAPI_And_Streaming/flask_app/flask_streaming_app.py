@@ -1,26 +1,445 @@
+import json
+import mimetypes
 import os
 import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 import requests
-import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, request, render_template, send_from_directory
+from flask import Flask, Response, abort, request, render_template, send_from_directory
+from werkzeug.security import safe_join
+
+from media_catalog import MediaCatalog
+from segment_pack import PackStore, pack_title
 
 app = Flask(__name__)
 
-FASTAPI_URL = "http://127.0.0.1:8000/process/"
+# Uploads go through the transcoder's resumable upload API in chunks of this size; a
+# failed chunk is retried from what the transcoder already has, up to UPLOAD_RETRIES times.
+UPLOADS_URL = "http://127.0.0.1:8000/uploads/"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+JOBS_URL = "http://127.0.0.1:8000/jobs/"
+# The upload request only spools the file; sending it to the transcoder, waiting for the
+# job and unpacking the result happen on these background workers.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+JOB_POLL_INTERVAL = 1
+# Finished uploads stay visible to /uploads/<id> and its events for this many seconds.
+UPLOAD_STATE_TTL = 3600
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+upload_tasks = {}
+# Notified on every task update; event streams wait on it.
+upload_tasks_changed = threading.Condition()
 DASH_ROOT = os.path.join(os.path.dirname(__file__), "dash")
 os.makedirs(DASH_ROOT, exist_ok=True)
+# Mode published title directories get. mkdtemp creates staging directories 0700, which
+# a web server running as another user (X-Sendfile) could not read. The umask can only
+# be read by setting it, so this happens once, before any worker thread starts.
+_umask = os.umask(0)
+os.umask(_umask)
+TITLE_DIR_MODE = 0o777 & ~_umask
+# Titles are listed from this catalog, updated on publish, instead of scanning DASH_ROOT.
+catalog = MediaCatalog(os.path.join(DASH_ROOT, ".catalog.sqlite3"), DASH_ROOT)
+INDEX_PAGE_SIZE = 50
+# The transcoder can write HLS playlists next to manifest.mpd over the same segments.
+MANIFEST_MIMETYPES = {".mpd": "application/dash+xml", ".m3u8": "application/vnd.apple.mpegurl"}
+# Set when the transcoder runs with LIVE_PUBLISH_ROOT pointing at DASH_ROOT: titles are
+# then published segment by segment instead of being sent back as a zip.
+LIVE_PUBLISH = os.environ.get("LIVE_PUBLISH") == "1"
+# Segment names are unique per encode, so segments never change once written and can be
+# cached for good; manifests change while a live title is being published.
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MANIFEST_CACHE_CONTROL = "public, max-age=2"
+# Behind nginx/Apache, let the front server send files (X-Sendfile) instead of Python.
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+# The transcoder's zip is unpacked as it arrives, read from the response this much at a time.
+ZIP_READ_SIZE = 1024 * 1024
+# Segments are kept in memory up to this many bytes (LRU; 0 disables the cache). Files
+# over SEGMENT_CACHE_MAX_ENTRY are always sent from disk, and files modified in the last
+# SEGMENT_CACHE_MIN_AGE seconds may still be growing under live publishing.
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+SEGMENT_CACHE_MAX_ENTRY = 16 * 1024 * 1024
+SEGMENT_CACHE_MIN_AGE = 2
+# Init segments plus this many chunks per stream are loaded when a title is published,
+# and for the most recently published titles at startup.
+SEGMENT_CACHE_WARM_CHUNKS = 3
+SEGMENT_CACHE_WARM_TITLES = 5
+# With PACKED_STORAGE=1 a published title's segments are packed into one blob served
+# from a memory map (same URLs). Titles packed with segment_pack.py also need it set,
+# since packs are only looked up when it is.
+PACKED_STORAGE = os.environ.get("PACKED_STORAGE") == "1"
+PACK_OPEN_MAX = 256
+packs = PackStore(PACK_OPEN_MAX)
+
+class SegmentCache:
+    """Byte-budgeted LRU of segment files, keyed by path."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            self.bytes_saved += len(entry["data"])
+            return entry
+
+    def load(self, path, min_age=SEGMENT_CACHE_MIN_AGE):
+        """Read a finished segment into the cache; None when it is too big or too new."""
+        stat = os.stat(path)
+        if not 0 < stat.st_size <= min(SEGMENT_CACHE_MAX_ENTRY, self.max_bytes):
+            return None
+        if time.time() - stat.st_mtime < min_age:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        # Same ETag send_from_directory would give the file, so caches revalidate either way.
+        entry = {
+            "data": data,
+            "mtime": stat.st_mtime,
+            "etag": f"{stat.st_mtime}-{len(data)}-{zlib.adler32(path.encode()) & 0xFFFFFFFF}",
+        }
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.bytes -= len(old["data"])
+            self.entries[path] = entry
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted["data"])
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, directory):
+        prefix = os.path.join(directory, "")
+        with self.lock:
+            for path in [path for path in self.entries if path.startswith(prefix)]:
+                self.bytes -= len(self.entries.pop(path)["data"])
+
+    def stats(self):
+        with self.lock:
+            requests_seen = self.hits + self.misses
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": self.bytes,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests_seen, 4) if requests_seen else None,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+            }
+
+segment_cache = SegmentCache(SEGMENT_CACHE_MAX_BYTES)
+
+def warm_title(media_dir, min_age=0):
+    """Load a title's init segments and its first chunks of every stream into the cache."""
+    streams = {}
+    for name in sorted(os.listdir(media_dir)):
+        if not name.endswith(".m4s"):
+            continue
+        if name.startswith("init-"):
+            segment_cache.load(os.path.join(media_dir, name), min_age)
+        else:
+            # chunk-<token>-stream<id>-<number>.m4s: group by everything before the number.
+            streams.setdefault(name.rsplit("-", 1)[0], []).append(name)
+    for names in streams.values():
+        for name in names[:SEGMENT_CACHE_WARM_CHUNKS]:
+            segment_cache.load(os.path.join(media_dir, name), min_age)
+
+def warm_recent_titles():
+    for title in catalog.recent(SEGMENT_CACHE_WARM_TITLES):
+        warm_title(os.path.join(DASH_ROOT, title["name"]), SEGMENT_CACHE_MIN_AGE)
+    print(f"Segment cache warmed: {segment_cache.stats()}")
+
+def segment_response(entry, filename):
+    """A response for a cached segment with the headers, 304s and ranges send_file would give."""
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = app.response_class(entry["data"], mimetype=mimetype)
+    response.set_etag(entry["etag"])
+    response.last_modified = entry["mtime"]
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(entry["data"]))
+
+def upload_resumable(path, filename, on_progress=None):
+    """Send a file to the transcoder chunk by chunk and return the upload id."""
+    size = os.path.getsize(path)
+    r = requests.post(UPLOADS_URL, params={"filename": filename, "size": size}, timeout=30)
+    r.raise_for_status()
+    upload_id = r.json()["upload_id"]
+
+    offset = 0
+    failures = 0
+    with open(path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            try:
+                r = requests.put(f"{UPLOADS_URL}{upload_id}", params={"offset": offset}, data=chunk, timeout=60)
+                r.raise_for_status()
+                offset += len(chunk)
+            except requests.RequestException as e:
+                failures += 1
+                if failures > UPLOAD_RETRIES:
+                    raise
+                print(f"Chunk at offset {offset} failed ({e}), resuming")
+                time.sleep(min(2 ** failures, 30))
+                status = requests.get(f"{UPLOADS_URL}{upload_id}", timeout=30)
+                status.raise_for_status()
+                offset = status.json()["next_offset"]
+            if on_progress:
+                on_progress(offset / size)
+    return upload_id
+
+class UploadTask:
+    """One upload on its way through the background pipeline.
+
+    Stages: queued, uploading, transcoding, publishing, then done or failed.
+    """
+
+    def __init__(self, filename, spool_path):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.spool_path = spool_path
+        self.stage = "queued"
+        self.progress = None
+        self.message = None
+        self.version = 0
+        self.created_at = self.updated_at = time.time()
+
+    def update(self, stage=None, progress=None, message=None):
+        with upload_tasks_changed:
+            if stage is not None:
+                self.stage = stage
+            self.progress = progress
+            if message is not None:
+                self.message = message
+            self.version += 1
+            self.updated_at = time.time()
+            upload_tasks_changed.notify_all()
+
+    def finished(self):
+        return self.stage in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "stage": self.stage,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+def remove_expired_tasks():
+    now = time.time()
+    with upload_tasks_changed:
+        for task in [task for task in upload_tasks.values()
+                     if task.finished() and now - task.updated_at > UPLOAD_STATE_TTL]:
+            del upload_tasks[task.id]
+
+def wait_for_job(job_id, task):
+    """Poll a transcoder job until it finishes, reporting its encode progress on `task`."""
+    failures = 0
+    while True:
+        try:
+            r = requests.get(f"{JOBS_URL}{job_id}", timeout=30)
+            r.raise_for_status()
+            failures = 0
+        except requests.RequestException:
+            failures += 1
+            if failures > UPLOAD_RETRIES:
+                raise
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        job = r.json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        ratios = [encode["progress"] for encode in job.get("progress", []) if encode.get("progress") is not None]
+        task.update("transcoding", sum(ratios) / len(ratios) if ratios else None)
+        time.sleep(JOB_POLL_INTERVAL)
+
+def install_title(response, base_name):
+    """Unpack a transcoder zip response into DASH_ROOT/<base_name>.
+
+    Unpacked into a hidden staging directory while the zip streams in, and only renamed
+    into DASH_ROOT once every entry checked out.
+    """
+    dest_dir = os.path.join(DASH_ROOT, base_name)
+    staging_dir = tempfile.mkdtemp(prefix=f".{base_name}-", dir=DASH_ROOT)
+    try:
+        with response:
+            response.raise_for_status()
+            extract_zip_stream(response.iter_content(chunk_size=ZIP_READ_SIZE), staging_dir)
+        if not os.path.exists(os.path.join(staging_dir, "manifest.mpd")):
+            raise ValueError("Processing failed - no manifest created")
+        if PACKED_STORAGE:
+            pack_title(staging_dir)
+        os.chmod(staging_dir, TITLE_DIR_MODE)
+        publish_title(staging_dir, dest_dir)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    return dest_dir
+
+def process_upload(task):
+    """Background pipeline: upload to the transcoder, wait for the job, publish the result."""
+    base_name, _ = os.path.splitext(task.filename)
+    try:
+        print(f"Sending {task.filename} to FastAPI...")
+        task.update("uploading", 0.0)
+        upload_id = upload_resumable(task.spool_path, task.filename, lambda ratio: task.update(progress=ratio))
+        params = {"queue": "true"}
+        if LIVE_PUBLISH:
+            params["live"] = "true"
+        r = requests.post(f"{UPLOADS_URL}{upload_id}/finalize", params=params, timeout=60)
+        r.raise_for_status()
+        job_id = r.json()["job_id"]
+        if LIVE_PUBLISH:
+            catalog.add_pending(base_name)
+            task.update("transcoding", message="Publishing: it can be watched as soon as the first segments are ready")
+        else:
+            task.update("transcoding")
+
+        job = wait_for_job(job_id, task)
+        if job["status"] != "done":
+            raise RuntimeError(f"Transcode {job['status']}: {job.get('error')}")
+        dest_dir = os.path.join(DASH_ROOT, base_name)
+        if not LIVE_PUBLISH:
+            task.update("publishing")
+            dest_dir = install_title(requests.get(f"{JOBS_URL}{job_id}/result", stream=True, timeout=300), base_name)
+        # The transcoder keeps finished jobs (and their output) until they are dropped.
+        requests.delete(f"{JOBS_URL}{job_id}", timeout=30)
+
+        catalog.publish(base_name)
+        packs.invalidate(dest_dir)
+        if segment_cache.max_bytes:
+            segment_cache.invalidate(dest_dir)
+            warm_title(dest_dir)
+        task.update("done", 1.0, f"Successfully uploaded and processed: {task.filename}")
+    except requests.RequestException as e:
+        task.update("failed", message=f"Error processing file: {e}")
+    except Exception as e:
+        task.update("failed", message=f"Error: {e}")
+    finally:
+        print(f"Upload {task.id} ({task.filename}): {task.stage}")
+        os.remove(task.spool_path)
+
+class StreamReader:
+    """Exact-size reads over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b""
+
+    def read_pieces(self, size):
+        """Yield exactly `size` bytes, in the pieces they arrive in."""
+        while size > 0:
+            if not self.buffer:
+                self.buffer = next(self.chunks, b"")
+                if not self.buffer:
+                    raise ValueError("Zip stream ended early")
+            piece, self.buffer = self.buffer[:size], self.buffer[size:]
+            size -= len(piece)
+            yield piece
+
+    def read(self, size):
+        return b"".join(self.read_pieces(size))
 
-def get_media_list():
-    media_list = []
-    if os.path.exists(DASH_ROOT):
-        for item in os.listdir(DASH_ROOT):
-            item_path = os.path.join(DASH_ROOT, item)
-            if os.path.isdir(item_path):
-                manifest_path = os.path.join(item_path, "manifest.mpd")
-                if os.path.exists(manifest_path):
-                    media_list.append(item)
-    return sorted(media_list)
+def extract_zip_stream(chunks, dest_dir):
+    """Unpack a zip from an iterator of byte chunks into `dest_dir` without saving the archive.
+
+    Works for archives whose local headers carry the sizes and CRC, which the transcoder
+    always writes; entries that defer them to a data descriptor cannot be streamed.
+    Stops at the central directory. Returns the extracted names.
+    """
+    reader = StreamReader(chunks)
+    names = []
+    while True:
+        signature = reader.read(4)
+        if signature != b"PK\x03\x04":
+            # Central directory (or end record): every entry has been seen.
+            return names
+        (_, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length) = struct.unpack("<HHHHHIIIHH", reader.read(26))
+        name = reader.read(name_length).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = reader.read(extra_length)
+        if flags & 0x08:
+            raise ValueError(f"{name}: sizes are in a data descriptor, the zip cannot be streamed")
+        if 0xFFFFFFFF in (compressed_size, size):
+            size, compressed_size = zip64_sizes(extra)
+        if method not in (0, 8):
+            raise ValueError(f"{name}: unsupported compression method {method}")
+
+        parts = name.split("/")
+        if name.startswith("/") or ".." in parts or ":" in name:
+            raise ValueError(f"Unsafe path in zip: {name}")
+        target = os.path.join(dest_dir, *parts)
+        if name.endswith("/"):
+            os.makedirs(target, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        decompressor = zlib.decompressobj(-15) if method == 8 else None
+        written = 0
+        checksum = 0
+        with open(target, "wb") as out:
+            for piece in reader.read_pieces(compressed_size):
+                if decompressor is not None:
+                    piece = decompressor.decompress(piece)
+                out.write(piece)
+                written += len(piece)
+                checksum = zlib.crc32(piece, checksum)
+            if decompressor is not None:
+                tail = decompressor.flush()
+                out.write(tail)
+                written += len(tail)
+                checksum = zlib.crc32(tail, checksum)
+        if written != size or checksum != crc:
+            raise ValueError(f"{name}: size or CRC mismatch")
+        names.append(name)
+
+def zip64_sizes(extra):
+    """(size, compressed_size) from the zip64 extended information extra field."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[offset:offset + 4])
+        if header_id == 0x0001:
+            return struct.unpack("<QQ", extra[offset + 4:offset + 20])
+        offset += 4 + length
+    raise ValueError("Zip64 entry without its extra field")
+
+def publish_title(staging_dir, dest_dir):
+    """Move a fully extracted title into place.
+
+    A title being replaced is renamed aside first, so players see either the old or the
+    new package; both renames stay on DASH_ROOT's filesystem.
+    """
+    old_dir = None
+    if os.path.exists(dest_dir):
+        old_dir = tempfile.mkdtemp(prefix=".old-", dir=DASH_ROOT)
+        os.rename(dest_dir, os.path.join(old_dir, "title"))
+    os.rename(staging_dir, dest_dir)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -31,41 +450,59 @@ def index():
             message = "No file selected"
         else:
             print(f"Processing file: {file.filename}")
-            try:
-                files = {"file": (file.filename, file.stream, file.mimetype)}
-                print("Sending file to FastAPI...")
-                r = requests.post(FASTAPI_URL, files=files, stream=True, timeout=300)
-                r.raise_for_status()
-                
-                base_name, _ = os.path.splitext(file.filename)
-                dest_dir = os.path.join(DASH_ROOT, base_name)
-
-                if os.path.exists(dest_dir):
-                    shutil.rmtree(dest_dir)
-                os.makedirs(dest_dir)
-
-                zip_path = os.path.join(DASH_ROOT, f"{base_name}.zip")
-                with open(zip_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
-
-                with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                    zip_ref.extractall(dest_dir)
-                
-                os.remove(zip_path)
-                
-                manifest_path = os.path.join(dest_dir, "manifest.mpd")
-                if os.path.exists(manifest_path):
-                    message = f"Successfully uploaded and processed: {file.filename}"
-                else:
-                    message = "Error: Processing failed - no manifest created"
-            except requests.RequestException as e:
-                message = f"Error processing file: {e}"
-            except Exception as e:
-                message = f"Error: {e}"
-    
-    media_list = get_media_list()
-    return render_template("index.html", media_list=media_list, message=message)
+            # Spooled to a file of our own: the request's copy goes away when it returns.
+            fd, spool_path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(file.filename)[1])
+            os.close(fd)
+            file.save(spool_path)
+            task = UploadTask(file.filename, spool_path)
+            with upload_tasks_changed:
+                upload_tasks[task.id] = task
+            upload_executor.submit(process_upload, task)
+            message = f"Uploading {file.filename}: progress is shown below"
+
+    return render_index(message)
+
+def render_index(message=None):
+    remove_expired_tasks()
+    query = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    titles, total = catalog.search(query, page, INDEX_PAGE_SIZE)
+    pages = max(1, -(-total // INDEX_PAGE_SIZE))
+    with upload_tasks_changed:
+        uploads = [task.to_dict() for task in upload_tasks.values()]
+    return render_template("index.html", titles=titles, total=total, query=query, page=page, pages=pages,
+                           uploads=uploads, message=message)
+
+def get_task(task_id):
+    with upload_tasks_changed:
+        task = upload_tasks.get(task_id)
+    if task is None:
+        abort(404)
+    return task
+
+@app.route("/uploads/<task_id>")
+def upload_status(task_id):
+    return get_task(task_id).to_dict()
+
+@app.route("/uploads/<task_id>/events")
+def upload_events(task_id):
+    """Server-sent events: the task's state on every change until it is done or failed."""
+    task = get_task(task_id)
+
+    def events():
+        version = -1
+        while True:
+            with upload_tasks_changed:
+                upload_tasks_changed.wait_for(lambda: task.version != version, timeout=15)
+                changed = task.version != version
+                version = task.version
+                state = task.to_dict()
+            yield f"data: {json.dumps(state)}\n\n" if changed else ": keepalive\n\n"
+            if state["stage"] in ("done", "failed"):
+                return
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/watch/<media_name>")
 def watch(media_name):
@@ -74,12 +511,73 @@ def watch(media_name):
     
     if not os.path.exists(manifest_path):
         return f"Media '{media_name}' not found", 404
+    title = catalog.get(media_name)
+    if title is None or title["status"] != "ready":
+        # Published by the transcoder directly (live) or outside this app: refresh the entry.
+        catalog.publish(media_name)
     return render_template("watch.html", media_name=media_name)
 
+def packed_segment_response(media_name, filename):
+    """Serve a segment out of the title's pack; None when the title is not packed."""
+    title_dir = safe_join(DASH_ROOT, media_name)
+    if title_dir is None:
+        abort(404)
+    for _ in range(2):
+        pack = packs.get(title_dir)
+        if pack is None:
+            return None
+        location = pack.locate(filename)
+        if location is None:
+            # Not a packed segment (e.g. ladder.json): serve it from disk.
+            return None
+        offset, length = location
+        try:
+            data = pack.read(offset, length)
+        except ValueError:
+            # Unmapped by a concurrent republish of the title; look it up again.
+            continue
+        entry = {"data": data, "mtime": pack.created_at, "etag": f"{pack.created_at}-{offset}-{length}"}
+        return segment_response(entry, filename)
+    abort(503)
+
 @app.route("/dash/<media_name>/<path:filename>")
 def serve_dash(media_name, filename):
+    # send_from_directory answers If-None-Match/If-Modified-Since with 304, serves Range
+    # requests and hands the file to the server's file wrapper (sendfile) when it can.
     media_dir = os.path.join(DASH_ROOT, media_name)
-    return send_from_directory(media_dir, filename)
+    extension = os.path.splitext(filename)[1].lower()
+    if PACKED_STORAGE and extension not in MANIFEST_MIMETYPES:
+        response = packed_segment_response(media_name, filename)
+        if response is not None:
+            response.headers["Cache-Control"] = SEGMENT_CACHE_CONTROL
+            return response
+    if segment_cache.max_bytes and extension not in MANIFEST_MIMETYPES:
+        path = safe_join(DASH_ROOT, media_name, filename)
+        if path is None:
+            abort(404)
+        entry = segment_cache.get(path)
+        if entry is None and os.path.isfile(path):
+            try:
+                entry = segment_cache.load(path)
+            except OSError:
+                entry = None
+        if entry is not None:
+            response = segment_response(entry, filename)
+            response.headers["Cache-Control"] = SEGMENT_CACHE_CONTROL
+            return response
+    response = send_from_directory(media_dir, filename, mimetype=MANIFEST_MIMETYPES.get(extension),
+                                   conditional=True, etag=True)
+    response.headers["Cache-Control"] = MANIFEST_CACHE_CONTROL if extension in MANIFEST_MIMETYPES else SEGMENT_CACHE_CONTROL
+    return response
+
+@app.route("/cache/stats")
+def segment_cache_stats():
+    return segment_cache.stats()
+
+# One scan at startup picks up titles published while the app was down.
+print(f"Media catalog: {catalog.sync()} titles")
+if segment_cache.max_bytes:
+    threading.Thread(target=warm_recent_titles, daemon=True).start()
 
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""SQLite catalog of the titles in DASH_ROOT, so listing them never walks the directory."""
+import json
+import os
+import re
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+MPD_NAMESPACE = "{urn:mpeg:dash:schema:mpd:2011}"
+# Titles listed as publishing are dropped by sync() once this old without any files.
+PENDING_GRACE = 3600
+ISO_DURATION = re.compile(r"P(?:(?P<days>[\d.]+)D)?(?:T(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?)?")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS titles (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    duration REAL,
+    renditions TEXT NOT NULL DEFAULT '[]',
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS titles_created_at ON titles (created_at);
+"""
+
+
+def parse_duration(value):
+    """Seconds in an xs:duration such as "PT1M2.500S"; None when missing or malformed."""
+    match = ISO_DURATION.fullmatch(value or "")
+    if not match or not value.strip("PT"):
+        return None
+    parts = {key: float(number) for key, number in match.groupdict().items() if number}
+    return (parts.get("days", 0) * 86400 + parts.get("hours", 0) * 3600
+            + parts.get("minutes", 0) * 60 + parts.get("seconds", 0))
+
+
+def read_manifest(manifest_path):
+    """(status, duration, renditions) from a DASH manifest.
+
+    A dynamic manifest belongs to a title the transcoder is still publishing.
+    """
+    root = ET.parse(manifest_path).getroot()
+    status = "publishing" if root.get("type") == "dynamic" else "ready"
+    renditions = []
+    for adaptation_set in root.iter(f"{MPD_NAMESPACE}AdaptationSet"):
+        kind = adaptation_set.get("contentType") or (adaptation_set.get("mimeType") or "").split("/")[0]
+        for representation in adaptation_set.iter(f"{MPD_NAMESPACE}Representation"):
+            rendition = {
+                "id": representation.get("id"),
+                "kind": kind or (representation.get("mimeType") or "").split("/")[0],
+                "codecs": representation.get("codecs"),
+                "bandwidth": int(representation.get("bandwidth") or 0),
+            }
+            if representation.get("height"):
+                rendition["width"] = int(representation.get("width") or 0)
+                rendition["height"] = int(representation.get("height"))
+            renditions.append(rendition)
+    return status, parse_duration(root.get("mediaPresentationDuration")), renditions
+
+
+def dir_usage(path):
+    size = 0
+    count = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+            count += 1
+    return size, count
+
+
+class MediaCatalog:
+    def __init__(self, db_path, dash_root):
+        self.db_path = db_path
+        self.dash_root = dash_root
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """A short-lived connection (one per call keeps this safe across request threads)."""
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def publish(self, name):
+        """Record (or refresh) a title from its directory. Returns False if it has no manifest."""
+        media_dir = os.path.join(self.dash_root, name)
+        manifest_path = os.path.join(media_dir, "manifest.mpd")
+        if not os.path.exists(manifest_path):
+            return False
+        try:
+            status, duration, renditions = read_manifest(manifest_path)
+        except ET.ParseError:
+            # Caught mid-rewrite by a live publish; the next refresh will pick it up.
+            status, duration, renditions = "publishing", None, []
+        size, count = dir_usage(media_dir)
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO titles (name, status, duration, renditions, size_bytes, file_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET status=excluded.status, duration=excluded.duration, "
+                "renditions=excluded.renditions, size_bytes=excluded.size_bytes, file_count=excluded.file_count",
+                (name, status, duration, json.dumps(renditions), size, count, os.path.getmtime(manifest_path)),
+            )
+        return True
+
+    def add_pending(self, name):
+        """List a title the transcoder has been asked to publish before it has any files."""
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO titles (name, status, created_at) VALUES (?, 'publishing', ?) "
+                "ON CONFLICT(name) DO UPDATE SET status='publishing', created_at=excluded.created_at",
+                (name, time.time()),
+            )
+
+    def remove(self, name):
+        with self.connect() as db:
+            db.execute("DELETE FROM titles WHERE name = ?", (name,))
+
+    def get(self, name):
+        with self.connect() as db:
+            row = db.execute("SELECT * FROM titles WHERE name = ?", (name,)).fetchone()
+        return self.to_dict(row) if row else None
+
+    def search(self, query="", page=1, page_size=50):
+        """One page of titles, newest first, whose name contains `query`. Returns (titles, total)."""
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self.connect() as db:
+            total = db.execute("SELECT COUNT(*) FROM titles WHERE name LIKE ? ESCAPE '\\'", (pattern,)).fetchone()[0]
+            rows = db.execute(
+                "SELECT * FROM titles WHERE name LIKE ? ESCAPE '\\' ORDER BY created_at DESC, name LIMIT ? OFFSET ?",
+                (pattern, page_size, (page - 1) * page_size),
+            ).fetchall()
+        return [self.to_dict(row) for row in rows], total
+
+    def recent(self, limit):
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT * FROM titles WHERE status = 'ready' ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self.to_dict(row) for row in rows]
+
+    def sync(self):
+        """Reconcile the catalog with DASH_ROOT once: add unknown titles, drop vanished ones."""
+        known = {}
+        with self.connect() as db:
+            for row in db.execute("SELECT name, status, created_at FROM titles"):
+                known[row["name"]] = row
+        present = set()
+        for item in os.listdir(self.dash_root):
+            # Dot-directories are titles still being extracted (or being replaced).
+            if item.startswith(".") or not os.path.isdir(os.path.join(self.dash_root, item)):
+                continue
+            if (item in known and known[item]["status"] == "ready") or self.publish(item):
+                present.add(item)
+        cutoff = time.time() - PENDING_GRACE
+        gone = [name for name, row in known.items()
+                if name not in present and (row["status"] == "ready" or row["created_at"] < cutoff)]
+        with self.connect() as db:
+            db.executemany("DELETE FROM titles WHERE name = ?", [(name,) for name in gone])
+        return len(present)
+
+    @staticmethod
+    def to_dict(row):
+        title = dict(row)
+        title["renditions"] = json.loads(title["renditions"])
+        return title
@@ -0,0 +1,128 @@
+"""Packed segment storage: all of a title's .m4s files in one blob plus an offset index.
+
+    python segment_pack.py dash/<title> [...]    # pack already published titles
+
+The Flask app only serves packs with PACKED_STORAGE=1.
+"""
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+PACK_BLOB = "segments.pack"
+PACK_INDEX = "segments.idx.json"
+PACK_FORMAT_VERSION = 1
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def pack_title(media_dir):
+    """Move every .m4s file of a title into segments.pack. Returns the number packed.
+
+    The index is written last, so a title only counts as packed once the blob is whole;
+    the loose files are removed after that.
+    """
+    names = sorted(name for name in os.listdir(media_dir) if name.endswith(".m4s"))
+    if not names:
+        return 0
+    segments = {}
+    offset = 0
+    with open(os.path.join(media_dir, PACK_BLOB), "wb") as blob:
+        for name in names:
+            with open(os.path.join(media_dir, name), "rb") as src:
+                while True:
+                    block = src.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    blob.write(block)
+            length = blob.tell() - offset
+            segments[name] = [offset, length]
+            offset += length
+        blob.flush()
+        os.fsync(blob.fileno())
+
+    index_path = os.path.join(media_dir, PACK_INDEX)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"version": PACK_FORMAT_VERSION, "created_at": time.time(), "segments": segments}, f)
+    os.replace(index_path + ".tmp", index_path)
+    for name in names:
+        os.remove(os.path.join(media_dir, name))
+    return len(names)
+
+
+class SegmentPack:
+    """A read-only memory map of one title's blob."""
+
+    def __init__(self, media_dir):
+        with open(os.path.join(media_dir, PACK_INDEX)) as f:
+            index = json.load(f)
+        self.segments = index["segments"]
+        self.created_at = index["created_at"]
+        with open(os.path.join(media_dir, PACK_BLOB), "rb") as blob:
+            self.map = mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def locate(self, name):
+        """(offset, length) of a segment in the blob, or None."""
+        return self.segments.get(name)
+
+    def read(self, offset, length):
+        return self.map[offset:offset + length]
+
+    def close(self):
+        self.map.close()
+
+
+class PackStore:
+    """Open packs by title directory, least recently used ones unmapped past `max_open`.
+
+    Every lookup stats the pack index (one stat per request): a title packed while it
+    is being served is picked up at once, and a pack whose index changed or vanished
+    is reopened or dropped. Only packs are cached, never their absence.
+    """
+
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self.packs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, media_dir):
+        try:
+            mtime = os.stat(os.path.join(media_dir, PACK_INDEX)).st_mtime_ns
+        except FileNotFoundError:
+            self.invalidate(media_dir)
+            return None
+        with self.lock:
+            cached = self.packs.get(media_dir)
+            if cached is not None and cached[1] == mtime:
+                self.packs.move_to_end(media_dir)
+                return cached[0]
+        pack = SegmentPack(media_dir)
+        evicted = []
+        with self.lock:
+            cached = self.packs.get(media_dir)
+            if cached is not None and cached[1] == mtime:
+                pack.close()
+                return cached[0]
+            if cached is not None:
+                evicted.append(cached[0])
+            self.packs[media_dir] = (pack, mtime)
+            self.packs.move_to_end(media_dir)
+            while len(self.packs) > self.max_open:
+                _, (old, _) = self.packs.popitem(last=False)
+                evicted.append(old)
+        for old in evicted:
+            old.close()
+        return pack
+
+    def invalidate(self, media_dir):
+        with self.lock:
+            cached = self.packs.pop(media_dir, None)
+        if cached is not None:
+            cached[0].close()
+
+
+if __name__ == "__main__":
+    for title_dir in sys.argv[1:]:
+        print(f"{title_dir}: packed {pack_title(title_dir)} segments")
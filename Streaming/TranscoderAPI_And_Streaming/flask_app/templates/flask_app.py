@@ -1,8 +1,12 @@
 import os
 import shutil
+import sys
 import requests
 import zipfile
-from flask import Flask, request, render_template_string, send_from_directory
+from flask import Flask, abort, request, render_template_string, send_from_directory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from media_catalog import MediaCatalog
 
 app = Flask(__name__)
 
@@ -11,6 +15,14 @@ FASTAPI_URL = "http://127.0.0.1:8000/process/"
 # DASH storage folder
 DASH_ROOT = os.path.join(os.path.dirname(__file__), "dash")
 os.makedirs(DASH_ROOT, exist_ok=True)
+# Titles are listed from this catalog, updated on upload, instead of scanning DASH_ROOT.
+catalog = MediaCatalog(os.path.join(DASH_ROOT, ".catalog.sqlite3"), DASH_ROOT)
+INDEX_PAGE_SIZE = 50
+# The transcoder can write HLS playlists next to manifest.mpd over the same segments.
+MANIFEST_MIMETYPES = {".mpd": "application/dash+xml", ".m3u8": "application/vnd.apple.mpegurl"}
+# Segments are never rewritten under the same name, manifests are (live publishing).
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MANIFEST_CACHE_CONTROL = "public, max-age=2"
 
 
 HTML_INDEX = """
@@ -115,16 +127,9 @@ HTML_WATCH = """
 """
 
 def get_media_list():
-    media_list = []
-    if os.path.exists(DASH_ROOT):
-        for item in os.listdir(DASH_ROOT):
-            item_path = os.path.join(DASH_ROOT, item)
-            # Check if it's a directory and contains manifest.mpd
-            if os.path.isdir(item_path):
-                manifest_path = os.path.join(item_path, "manifest.mpd")
-                if os.path.exists(manifest_path):
-                    media_list.append(item)
-    return sorted(media_list)
+    """Names of the newest INDEX_PAGE_SIZE titles, from the catalog."""
+    titles, _ = catalog.search(page_size=INDEX_PAGE_SIZE)
+    return [title["name"] for title in titles]
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -150,6 +155,7 @@ def index():
                 if os.path.exists(dest_dir):
                     print(f"Removing existing directory: {dest_dir}")
                     shutil.rmtree(dest_dir)
+                    catalog.remove(base_name)
                 os.makedirs(dest_dir)
 
                 zip_path = os.path.join(DASH_ROOT, f"{base_name}.zip")
@@ -167,10 +173,11 @@ def index():
                 os.remove(zip_path)
                 
                 manifest_path = os.path.join(dest_dir, "manifest.mpd")
-                if os.path.exists(manifest_path):
+                if catalog.publish(base_name):
                     print(f"✓ Successfully processed: {base_name}")
                     message = f"Successfully uploaded and processed: {file.filename}"
                 else:
+                    catalog.remove(base_name)
                     print(f"✗ ERROR: Manifest not found at {manifest_path}")
                     message = "Error: Processing failed - no manifest created"
                 
@@ -197,37 +204,33 @@ def watch(media_name):
 @app.route("/dash/<media_name>/<path:filename>")
 def serve_dash(media_name, filename):
     media_dir = os.path.join(DASH_ROOT, media_name)
-    file_path = os.path.join(media_dir, filename)
-    
-    print(f"Serving: {filename} from {media_name}")
-    
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
-        if os.path.exists(media_dir):
-            available_files = os.listdir(media_dir)
-            print(f"Available files in {media_name}: {available_files}")
-        return f"File not found: {filename}", 404
-    
-    response = send_from_directory(media_dir, filename)
+    extension = os.path.splitext(filename)[1].lower()
+    # 404s, conditional GETs (304), Range requests and sendfile are handled by send_from_directory.
+    response = send_from_directory(media_dir, filename, mimetype=MANIFEST_MIMETYPES.get(extension),
+                                   conditional=True, etag=True)
+    response.headers['Cache-Control'] = MANIFEST_CACHE_CONTROL if extension in MANIFEST_MIMETYPES else SEGMENT_CACHE_CONTROL
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Range'
+    response.headers['Access-Control-Allow-Headers'] = 'Range, If-None-Match, If-Modified-Since'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag, Content-Range, Accept-Ranges'
     
     return response
 
 @app.route("/debug")
 def debug():
-    """Debug route to see what's in the DASH directory"""
-    debug_info = []
-    
-    if os.path.exists(DASH_ROOT):
-        for item in os.listdir(DASH_ROOT):
-            item_path = os.path.join(DASH_ROOT, item)
-            if os.path.isdir(item_path):
-                files = os.listdir(item_path)
-                debug_info.append(f"{item}/: {files}")
+    """Debug route listing the catalogued titles (only when running with debug on)"""
+    if not app.debug:
+        abort(404)
+    titles, _ = catalog.search(page_size=INDEX_PAGE_SIZE)
+    debug_info = [f"{title['name']}/: {title['status']}, {title['file_count']} files, {title['size_bytes']} bytes"
+                  for title in titles]
     
-    return f"<h2>Debug Info</h2><pre>{'<br>'.join(debug_info) if debug_info else 'No media directories found'}</pre><a href='/'>Back</a>"
+    return render_template_string(
+        "<h2>Debug Info</h2><pre>{{ info }}</pre><a href='/'>Back</a>",
+        info="\n".join(debug_info) if debug_info else "No media titles found")
+
+# One scan at startup picks up titles added while the app was down.
+print(f"Media catalog: {catalog.sync()} titles")
 
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,381 @@
+"""Playback load test for flask_streaming_app.py.
+
+Every simulated player reads a title's manifest.mpd, fetches the init segments and then
+keeps a video and an audio buffer filled, each along its own segment timeline: the next
+request always goes to the track that is buffered less far ahead, for the segment
+covering the media time that track is buffered up to. Playback advances in real time
+and needs both tracks; when it reaches the end of either buffer, it stalls. The video
+rendition is picked by a throughput-based ABR rule, so players step down when the
+server slows down.
+
+    python flask_app/flask_streaming_app.py &
+    python loadtest_streaming.py --media my_clip --players 50 --seconds 120 \
+        --server-pid $(pgrep -f flask_streaming_app) --output run.json
+    python loadtest_streaming.py ... --compare run.json
+
+--server-pid samples the server's CPU from /proc (Linux only).
+"""
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+MPD_NAMESPACE = "{urn:mpeg:dash:schema:mpd:2011}"
+# ABR: the highest video bitrate under this share of the measured throughput, and the
+# lowest one whenever the buffer is below PANIC_BUFFER seconds.
+ABR_SAFETY = 0.8
+PANIC_BUFFER = 4.0
+THROUGHPUT_EWMA = 0.3
+# Players start fetching this far apart so they do not all hit the same segments at once.
+DEFAULT_RAMP_SECONDS = 10
+TEMPLATE_NUMBER = re.compile(r"\$Number(%0(\d+)d)?\$")
+# Slack when comparing media times, which come from dividing timeline ticks.
+TIME_EPSILON = 1e-6
+
+
+def fill_template(template, representation_id, bandwidth, number=None, time_value=None):
+    url = template.replace("$RepresentationID$", representation_id).replace("$Bandwidth$", str(bandwidth))
+    if number is not None:
+        url = TEMPLATE_NUMBER.sub(lambda m: str(number).zfill(int(m.group(2) or 0)), url)
+    if time_value is not None:
+        url = url.replace("$Time$", str(time_value))
+    return url.replace("$$", "$")
+
+
+def parse_manifest(text):
+    """Representations of a SegmentTemplate/SegmentTimeline manifest, as written by ffmpeg.
+
+    Returns {"video": [...], "audio": [...]}; each representation has its init URL, its
+    segments as (url, start, duration) in seconds, and its bandwidth.
+    """
+    root = ET.fromstring(text)
+    streams = {"video": [], "audio": []}
+    for adaptation_set in root.iter(f"{MPD_NAMESPACE}AdaptationSet"):
+        kind = adaptation_set.get("contentType") or (adaptation_set.get("mimeType") or "").split("/")[0]
+        set_template = adaptation_set.find(f"{MPD_NAMESPACE}SegmentTemplate")
+        for representation in adaptation_set.iter(f"{MPD_NAMESPACE}Representation"):
+            template = representation.find(f"{MPD_NAMESPACE}SegmentTemplate")
+            if template is None:
+                template = set_template
+            if template is None:
+                continue
+            rep_kind = kind or (representation.get("mimeType") or "").split("/")[0]
+            rep_id = representation.get("id")
+            bandwidth = int(representation.get("bandwidth") or 0)
+            timescale = int(template.get("timescale") or 1)
+            number = int(template.get("startNumber") or 1)
+            segments = []
+            timeline = template.find(f"{MPD_NAMESPACE}SegmentTimeline")
+            if timeline is None:
+                continue
+            time_value = 0
+            for s in timeline.iter(f"{MPD_NAMESPACE}S"):
+                time_value = int(s.get("t", time_value))
+                duration = int(s.get("d"))
+                for _ in range(int(s.get("r", 0)) + 1):
+                    url = fill_template(template.get("media"), rep_id, bandwidth, number, time_value)
+                    segments.append((url, time_value / timescale, duration / timescale))
+                    number += 1
+                    time_value += duration
+            if rep_kind in streams:
+                streams[rep_kind].append({
+                    "id": rep_id,
+                    "bandwidth": bandwidth,
+                    "init": fill_template(template.get("initialization"), rep_id, bandwidth),
+                    "segments": segments,
+                })
+    for representations in streams.values():
+        representations.sort(key=lambda rep: rep["bandwidth"])
+    return streams
+
+
+class Stats:
+    """Counters shared by all players."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.startup_delays = []
+        self.switches = 0
+        self.bitrates = []
+        self.failures = []
+        # Set when a player cannot play at all; every player then stops.
+        self.aborted = threading.Event()
+
+    def request(self, latency, size):
+        with self.lock:
+            self.latencies.append(latency)
+            self.bytes += size
+
+    def abort(self, reason):
+        with self.lock:
+            self.failures.append(reason)
+        self.aborted.set()
+
+
+class Track:
+    """One media type's representations and how far ahead of playback it is buffered."""
+
+    def __init__(self, representations):
+        self.representations = representations
+        self.starts = [[start for _, start, _ in rep["segments"]] for rep in representations]
+        self.current = 0
+        self.end = 0.0
+        self.done = False
+
+    def next_segment(self):
+        """(url, start, duration) of the current representation's segment covering self.end."""
+        segments = self.representations[self.current]["segments"]
+        index = max(0, bisect.bisect_right(self.starts[self.current], self.end + TIME_EPSILON) - 1)
+        url, start, duration = segments[index]
+        if start + duration <= self.end + TIME_EPSILON:
+            self.done = True
+            return None
+        return url, start, duration
+
+
+class Player(threading.Thread):
+    def __init__(self, base_url, media, stats, stop_at, start_delay, speed, buffer_target):
+        super().__init__(daemon=True)
+        self.base_url = f"{base_url}/dash/{media}/"
+        self.stats = stats
+        self.stop_at = stop_at
+        self.start_delay = start_delay
+        self.speed = speed
+        self.buffer_target = buffer_target
+        self.session = requests.Session()
+
+    def fetch(self, path):
+        start = time.perf_counter()
+        try:
+            r = self.session.get(self.base_url + path, timeout=30)
+            r.raise_for_status()
+        except requests.RequestException:
+            with self.stats.lock:
+                self.stats.errors += 1
+            return None
+        latency = time.perf_counter() - start
+        self.stats.request(latency, len(r.content))
+        return len(r.content), latency
+
+    def choose(self, video, throughput, buffer_level):
+        if throughput is None or buffer_level < PANIC_BUFFER:
+            return 0
+        choice = 0
+        for index, rep in enumerate(video):
+            if rep["bandwidth"] <= throughput * ABR_SAFETY:
+                choice = index
+        return choice
+
+    def run(self):
+        if self.stats.aborted.wait(self.start_delay):
+            return
+        started = time.perf_counter()
+        try:
+            r = self.session.get(self.base_url + "manifest.mpd", timeout=30)
+            r.raise_for_status()
+            streams = parse_manifest(r.text)
+        except (requests.RequestException, ET.ParseError) as e:
+            self.stats.abort(f"Manifest for {self.base_url} unusable: {e}")
+            return
+        if not streams["video"]:
+            self.stats.abort(f"No video representations with a SegmentTimeline in {self.base_url}manifest.mpd")
+            return
+        video = Track(streams["video"])
+        tracks = [video] + ([Track(streams["audio"][:1])] if streams["audio"] else [])
+        for rep in streams["video"] + streams["audio"][:1]:
+            self.fetch(rep["init"])
+
+        throughput = None
+        position = 0.0
+        playing = False
+        stalled = False
+        last_tick = time.perf_counter()
+
+        def advance():
+            # Move the playhead; it cannot pass the end of the shorter buffer.
+            nonlocal position, stalled, last_tick
+            now = time.perf_counter()
+            if playing:
+                # A fully fetched track no longer limits playback.
+                available = min((track.end for track in tracks if not track.done), default=float("inf")) - position
+                elapsed = (now - last_tick) * self.speed
+                if elapsed > available:
+                    if not stalled:
+                        with self.stats.lock:
+                            self.stats.stalls += 1
+                    stalled = True
+                    with self.stats.lock:
+                        self.stats.stall_seconds += (elapsed - max(available, 0.0)) / self.speed
+                    position = max(position, position + available)
+                else:
+                    stalled = False
+                    position += elapsed
+            last_tick = now
+
+        while time.perf_counter() < self.stop_at and not self.stats.aborted.is_set():
+            pending = [track for track in tracks if not track.done]
+            if not pending:
+                break
+            track = min(pending, key=lambda t: t.end)
+            # Real-time pace: wait until that track's buffer drains back to the target.
+            ahead = track.end - position
+            if playing and ahead > self.buffer_target:
+                wait = (ahead - self.buffer_target) / self.speed
+                self.stats.aborted.wait(max(0.0, min(wait, self.stop_at - time.perf_counter())))
+                advance()
+                continue
+
+            if track is video:
+                next_rep = self.choose(video.representations, throughput, video.end - position)
+                if next_rep != video.current:
+                    video.current = next_rep
+                    with self.stats.lock:
+                        self.stats.switches += 1
+            segment = track.next_segment()
+            if segment is None:
+                continue
+            url, start, duration = segment
+            result = self.fetch(url)
+            advance()
+            # A failed segment is skipped, as a player would after its retries.
+            track.end = start + duration
+            if result is None:
+                continue
+            size, latency = result
+            sample = size * 8 / max(latency, 1e-6)
+            throughput = sample if throughput is None else (1 - THROUGHPUT_EWMA) * throughput + THROUGHPUT_EWMA * sample
+            if track is video:
+                with self.stats.lock:
+                    self.stats.bitrates.append(video.representations[video.current]["bandwidth"])
+
+            if not playing and all(t.end > 0 for t in tracks):
+                playing = True
+                last_tick = time.perf_counter()
+                with self.stats.lock:
+                    self.stats.startup_delays.append(last_tick - started)
+
+
+def cpu_seconds(pid):
+    """utime + stime of a process (all threads), or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_load(args):
+    stats = Stats()
+    stop_at = time.perf_counter() + args.ramp + args.seconds
+    players = [
+        Player(args.base_url, args.media[i % len(args.media)], stats, stop_at,
+               args.ramp * i / max(1, args.players), args.speed, args.buffer)
+        for i in range(args.players)
+    ]
+    cpu_start = cpu_seconds(args.server_pid) if args.server_pid else None
+    start = time.perf_counter()
+    for player in players:
+        player.start()
+    for player in players:
+        player.join()
+    wall = time.perf_counter() - start
+    cpu_end = cpu_seconds(args.server_pid) if args.server_pid else None
+
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "players": args.players,
+        "media": args.media,
+        "wall_seconds": round(wall, 2),
+        "requests": len(stats.latencies),
+        "errors": stats.errors,
+        "latency_p50_ms": ms(percentile(stats.latencies, 0.50)),
+        "latency_p90_ms": ms(percentile(stats.latencies, 0.90)),
+        "latency_p99_ms": ms(percentile(stats.latencies, 0.99)),
+        "latency_max_ms": ms(max(stats.latencies, default=None)),
+        "throughput_mbps": round(stats.bytes * 8 / wall / 1e6, 2),
+        "stalls": stats.stalls,
+        "stall_seconds": round(stats.stall_seconds, 2),
+        "startup_p50_ms": ms(percentile(stats.startup_delays, 0.50)),
+        "startup_p90_ms": ms(percentile(stats.startup_delays, 0.90)),
+        "bitrate_switches": stats.switches,
+        "mean_video_kbps": round(sum(stats.bitrates) / len(stats.bitrates) / 1000, 1) if stats.bitrates else None,
+        "server_cpu_percent": round((cpu_end - cpu_start) / wall * 100, 1)
+        if cpu_start is not None and cpu_end is not None else None,
+        "failures": stats.failures,
+    }
+
+
+def compare(result, baseline_path, threshold):
+    """Print deltas against a previous run; returns True on a p99 latency or stall regression."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["result"]
+    regressed = False
+    print(f"\n{'metric':<22} {'now':>10} {'baseline':>10}")
+    for key in ("latency_p50_ms", "latency_p99_ms", "throughput_mbps", "stalls", "server_cpu_percent"):
+        print(f"{key:<22} {str(result[key]):>10} {str(baseline.get(key)):>10}")
+    if result["latency_p99_ms"] is None:
+        print("REGRESSION: no segment requests succeeded")
+        regressed = True
+    elif baseline.get("latency_p99_ms") and result["latency_p99_ms"] > baseline["latency_p99_ms"] * (1 + threshold):
+        print("REGRESSION: p99 segment latency")
+        regressed = True
+    if result["stalls"] > baseline.get("stalls", 0):
+        print("REGRESSION: more stalls")
+        regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate DASH players against flask_streaming_app.py")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--media", type=lambda v: v.split(","), required=True,
+                        help="title(s) to play, comma separated; players are spread over them")
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=60, help="how long to play after the ramp-up")
+    parser.add_argument("--ramp", type=float, default=DEFAULT_RAMP_SECONDS, help="seconds over which players start")
+    parser.add_argument("--buffer", type=float, default=12.0, help="buffer target in media seconds")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed (>1 drains the buffer faster)")
+    parser.add_argument("--server-pid", type=int, help="sample this process's CPU use")
+    parser.add_argument("--output", help="write the result to this JSON file")
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.20, help="p99 latency increase that counts as a regression")
+    args = parser.parse_args()
+
+    result = run_load(args)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "result": result}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if result["failures"]:
+        print(f"Run aborted: {result['failures'][0]}")
+        sys.exit(1)
+    if args.compare and compare(result, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,183 +1,1930 @@
+import errno
+import hashlib
+import json
+import math
 import os
 import shutil
+import struct
 import subprocess
+import threading
 import zipfile
 import tempfile
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import Response
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import asyncio
 
 app = FastAPI()
 
-@app.post("/process/")
-async def process_media(file: UploadFile = File(...)):
-    temp_dir = tempfile.mkdtemp()
+# Each worker drives one ffmpeg at a time; ffmpeg is multi-threaded itself, so the
+# default leaves room for its threads instead of starting one job per core.
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+TRANSCODE_QUEUE_SIZE = int(os.environ.get("TRANSCODE_QUEUE_SIZE", TRANSCODE_WORKERS * 4))
+# Finished jobs (and their DASH output) are kept this many seconds for /jobs/<id>/result.
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 3600))
+# Expired jobs and upload sessions are swept this often, whether or not new requests come in.
+EXPIRY_SWEEP_INTERVAL = 60
+
+executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+jobs = {}
+jobs_lock = threading.Lock()
+
+# Resumable uploads (/uploads/) are dropped after this many seconds without a chunk.
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 64 * 1024 ** 3))
+# Open sessions are preallocated in full, so their number and declared sizes are capped.
+UPLOAD_MAX_SESSIONS = int(os.environ.get("UPLOAD_MAX_SESSIONS", 16))
+UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get("UPLOAD_MAX_TOTAL_BYTES", 2 * UPLOAD_MAX_BYTES))
+uploads = {}
+uploads_lock = threading.Lock()
+
+# Finished DASH packages are cached by input hash + encoder settings. 0 disables the cache.
+# The default lives in the user's cache directory (XDG), not in the source tree.
+TRANSCODE_CACHE_DIR = os.environ.get(
+    "TRANSCODE_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                 "transcoder", "transcode_cache"))
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get("TRANSCODE_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+# Bump when the ffmpeg pipeline changes in a way the settings below do not capture.
+CACHE_FORMAT_VERSION = 2
+
+# Running ffmpeg processes (for /encodes/ and /metrics) and totals over finished ones.
+active_encodes = set()
+encode_totals = {"processes": 0, "failed": 0, "wall_seconds": 0.0, "media_seconds": 0.0}
+encodes_lock = threading.Lock()
+# Only this many trailing lines of ffmpeg's stderr are kept per process.
+STDERR_TAIL_LINES = 200
+
+# Uploads are read and piped to ffmpeg in chunks of this size.
+INGEST_CHUNK_SIZE = 1024 * 1024
+# Bytes buffered from the start of an upload to probe it and sniff the container.
+PROBE_HEAD_BYTES = 8 * 1024 * 1024
+
+# Result zips are streamed in blocks of this size; media files in the archive are
+# stored as-is since they are already compressed.
+ZIP_BLOCK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+STORED_EXTENSIONS = {".m4s", ".mp4", ".m4a", ".m4v", ".ts", ".aac"}
+
+# Split long sources into this many keyframe-aligned ranges encoded side by side
+# (0 or 1 = single pass). Ranges are never shorter than PARALLEL_MIN_RANGE seconds.
+PARALLEL_SEGMENTS = int(os.environ.get("TRANSCODE_PARALLEL_SEGMENTS", 0))
+PARALLEL_MIN_RANGE = 30
+
+# Live mode (?live=true) encodes straight into LIVE_PUBLISH_ROOT/<title>/, normally the
+# Flask app's DASH_ROOT, so playback can start on the first segments. <title> is a
+# symlink to the hidden version directory currently being served.
+LIVE_PUBLISH_ROOT = os.environ.get("LIVE_PUBLISH_ROOT")
+LIVE_UTC_TIMING_URL = os.environ.get("LIVE_UTC_TIMING_URL")
+# How often a live re-encode checks for its first manifest before swapping it in.
+LIVE_SWAP_POLL_INTERVAL = 0.5
+
+# Stream-copy the top rung when the source is already H.264 at that resolution and no
+# more than this factor over the rung's bitrate; AAC audio is copied as well.
+REMUX_ENABLED = os.environ.get("TRANSCODE_REMUX", "1") == "1"
+REMUX_BITRATE_TOLERANCE = 1.25
+
+# Also write HLS playlists (master.m3u8 + one media playlist per stream) over the same
+# CMAF segments as manifest.mpd.
+HLS_ENABLED = os.environ.get("TRANSCODE_HLS") == "1"
+HLS_MASTER_NAME = "master.m3u8"
+
+# Encoder threads are budgeted across the ffmpeg processes running at once instead of
+# each one sizing itself to the whole machine. With TRANSCODE_CPU_AFFINITY=1 (Linux,
+# needs taskset) every process is also pinned to the least-booked cores.
+CPU_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+CPU_AFFINITY = os.environ.get("TRANSCODE_CPU_AFFINITY") == "1" and shutil.which("taskset") is not None
+MAX_ENCODE_THREADS = int(os.environ.get("TRANSCODE_MAX_THREADS", 16))
+# x264 preset at normal load; with adaptive presets on, the faster ones are used once
+# load per core (booked threads or the 1-minute load average) passes their threshold.
+X264_PRESET = os.environ.get("TRANSCODE_X264_PRESET", "medium")
+ADAPTIVE_PRESET = os.environ.get("TRANSCODE_ADAPTIVE_PRESET", "1") == "1"
+LOAD_PRESETS = [(2.0, "superfast"), (1.5, "veryfast"), (1.0, "faster")]
+
+SEGMENT_DURATION = "4"
+AUDIO_BITRATE = "128k"
+QUALITIES = [
+    {"height": 360, "width": 640, "bitrate": "800k"},
+    {"height": 720, "width": 1280, "bitrate": "2000k"}
+]
+
+# Content-aware ladder (?adaptive=true or TRANSCODE_ADAPTIVE_LADDER=1): a CRF test encode
+# of LADDER_SAMPLE_WINDOWS short windows at LADDER_PROBE_SIZE measures how hard the title
+# is to compress, and the rungs and bitrates below are chosen from that instead of
+# QUALITIES. Bitrates scale with pixel count to the power LADDER_SCALING_EXPONENT;
+# LADDER_BITRATE_SCALE maps the ultrafast test encode onto the real encoder preset.
+ADAPTIVE_LADDER = os.environ.get("TRANSCODE_ADAPTIVE_LADDER") == "1"
+LADDER_SAMPLE_WINDOWS = 3
+LADDER_SAMPLE_SECONDS = 4.0
+LADDER_PROBE_SIZE = (426, 240)
+LADDER_PROBE_CRF = 23
+LADDER_SCALING_EXPONENT = 0.75
+LADDER_BITRATE_SCALE = 0.7
+LADDER_CANDIDATES = [
+    {"height": 240, "width": 426, "min_kbps": 150, "max_kbps": 700},
+    {"height": 360, "width": 640, "min_kbps": 250, "max_kbps": 1400},
+    {"height": 480, "width": 854, "min_kbps": 400, "max_kbps": 2500},
+    {"height": 720, "width": 1280, "min_kbps": 600, "max_kbps": 4500},
+]
+# A lower rung is only kept when it is at least this much cheaper than the one above,
+# and no rungs are added below one that is already at or under LADDER_FLOOR_KBPS.
+LADDER_MIN_STEP = 1.6
+LADDER_FLOOR_KBPS = 400
+LADDER_FILE_NAME = "ladder.json"
+
+
+def needs_seekable_input(head):
+    """True for MP4/MOV files whose moov atom is not at the front (ffmpeg must seek to read them)."""
+    if head[4:8] != b"ftyp":
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[offset:offset + 8])
+        if box_type == b"moov":
+            return offset + size > len(head)
+        if box_type == b"mdat":
+            return True
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if size < 8:
+            break
+        offset += size
+    return True
+
+
+def read_head(chunks, limit):
+    head = bytearray()
+    for chunk in chunks:
+        head.extend(chunk)
+        if len(head) >= limit:
+            break
+    return bytes(head)
+
+
+def iter_sync(agen, loop):
+    """Pull chunks from an async iterator owned by `loop` from a worker thread."""
+    async def next_chunk():
+        return await agen.__anext__()
+
+    while True:
+        try:
+            chunk = asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()
+        except StopAsyncIteration:
+            return
+        if chunk:
+            yield chunk
+
+
+async def iter_upload(file):
+    while True:
+        chunk = await file.read(INGEST_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_float(value):
     try:
-        print(f"Processing {file.filename} in temporary directory: {temp_dir}")
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
 
-        input_path = os.path.join(temp_dir, file.filename)
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
 
-        base_name, _ = os.path.splitext(file.filename)
-        dash_dir = os.path.join(temp_dir, "dash_output")
-        os.makedirs(dash_dir, exist_ok=True)
-        manifest_path = os.path.join(dash_dir, "manifest.mpd")
+def audio_only_info():
+    return {
+        "has_video": False, "height": 0, "width": 0, "duration": 0.0, "start_time": 0.0,
+        "video_codec": None, "pix_fmt": None, "video_bitrate": 0, "audio_codec": None,
+    }
+
+
+def parse_bitrate(value):
+    """Parse an ffmpeg bitrate such as "800k" or "2M" into bits per second."""
+    value = str(value).strip().lower()
+    multiplier = {"k": 1000, "m": 1000 ** 2}.get(value[-1:], 1)
+    return int(parse_float(value.rstrip("km")) * multiplier)
+
+
+def probe_media(input_spec, stdin_data=None):
+    probe_command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,pix_fmt,width,height,bit_rate:format=duration,start_time,bit_rate",
+        "-of", "json",
+        input_spec,
+    ]
+    probe_result = subprocess.run(probe_command, input=stdin_data, capture_output=True, check=True)
+    probe = json.loads(probe_result.stdout or b"{}")
+    info = audio_only_info()
+    # Durations and bitrates are usually unknown ("N/A") when probing the head of a pipe.
+    info["duration"] = parse_float(probe.get("format", {}).get("duration"))
+    info["start_time"] = parse_float(probe.get("format", {}).get("start_time"))
+    streams = probe.get("streams") or []
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    if audio:
+        info["audio_codec"] = audio.get("codec_name")
+    if video and video.get("height"):
+        info["has_video"] = True
+        info["height"] = int(video["height"])
+        info["width"] = int(video.get("width") or 0)
+        info["video_codec"] = video.get("codec_name")
+        info["pix_fmt"] = video.get("pix_fmt")
+        video_bitrate = parse_float(video.get("bit_rate"))
+        if not video_bitrate:
+            # Matroska and friends only report an overall bitrate.
+            video_bitrate = parse_float(probe.get("format", {}).get("bit_rate"))
+            if video_bitrate and audio:
+                video_bitrate -= parse_float(audio.get("bit_rate")) or parse_bitrate(AUDIO_BITRATE)
+        info["video_bitrate"] = max(0, int(video_bitrate))
+    return info
+
+
+def can_remux_video(info, q):
+    """True when the source video can be stream-copied as rung `q` as-is."""
+    return (
+        info["video_codec"] == "h264"
+        and info["pix_fmt"] == "yuv420p"
+        and info["height"] == q["height"]
+        and info["width"] <= q["width"]
+        and 0 < info["video_bitrate"] <= parse_bitrate(q["bitrate"]) * REMUX_BITRATE_TOLERANCE
+    )
+
+
+def select_rungs(info, options):
+    """Ladder rungs for this source. The top rung is marked "copy" when it can be remuxed.
+
+    A ladder chosen by analyze_ladder() (info["ladder"]) replaces QUALITIES.
+    """
+    qualities = info.get("ladder") or QUALITIES
+    rungs = [dict(q, copy=False) for q in qualities if info["height"] >= q["height"]]
+    if not rungs:
+        rungs = [dict(qualities[0], copy=False)]
+        print(f"Warning: Source height ({info['height']}p) is low. Defaulting to one output stream at {rungs[0]['height']}p.")
+    elif options.get("remux") and can_remux_video(info, rungs[-1]):
+        rungs[-1]["copy"] = True
+        print(f"Source already matches the {rungs[-1]['height']}p rung ({info['video_bitrate']} bps h264), remuxing it")
+    return rungs
+
+
+def audio_codec_args(info, options, stream_spec=":a:0"):
+    if options.get("remux") and info["audio_codec"] == "aac":
+        return [f"-c{stream_spec}", "copy"]
+    return [f"-c{stream_spec}", "aac", f"-b{stream_spec}", AUDIO_BITRATE]
+
+
+def video_rung_args(index, q, copying, preset=X264_PRESET, threads=None):
+    """Encoder arguments for output video stream `index`."""
+    if q["copy"]:
+        return [f"-c:v:{index}", "copy"]
+    args = [
+        f"-c:v:{index}", "libx264",
+        f"-preset:v:{index}", preset,
+        f"-b:v:{index}", q["bitrate"],
+        f"-s:v:{index}", f"{q['width']}x{q['height']}"
+    ]
+    # Keep encoded rungs' keyframes (and so segment boundaries) on the remuxed rung's;
+    # otherwise on every SEGMENT_DURATION, as the range-parallel encode does.
+    args.extend([f"-force_key_frames:v:{index}", "source" if copying else segment_keyframes()])
+    if threads:
+        args.extend([f"-threads:v:{index}", str(threads)])
+    return args
 
-        has_video = False
-        source_height = 0
+
+def split_threads(total, count):
+    """Divide a slot's thread budget between `count` encoders (-threads is per encoder)."""
+    return [total // count + (1 if i < total % count else 0) for i in range(count)]
+
+
+def encoded_streams(rungs):
+    """Number of video encoders a set of rungs runs; remuxed rungs cost none."""
+    return sum(1 for q in rungs if not q["copy"])
+
+
+def segment_keyframes(offset=0.0):
+    """force_key_frames expression for a keyframe on every SEGMENT_DURATION multiple of
+    source time, for an encode whose output starts `offset` seconds into the source."""
+    first = math.ceil(offset / float(SEGMENT_DURATION) - 1e-6)
+    return f"expr:gte(t+{offset:.6f},({first}+n_forced)*{SEGMENT_DURATION})"
+
+
+def dash_output_args(manifest_path, options, adaptation_sets=None):
+    args = [
+        "-f", "dash",
+        "-seg_duration", SEGMENT_DURATION,
+        "-use_template", "1",
+        "-use_timeline", "1",
+    ]
+    if options.get("hls"):
+        # One set of CMAF (fragmented MP4) segments, referenced by both manifest.mpd and
+        # the HLS master/media playlists, so HLS costs no second encode.
+        args.extend(["-dash_segment_type", "mp4", "-hls_playlist", "1", "-hls_master_name", HLS_MASTER_NAME])
+    if options.get("live") and LIVE_UTC_TIMING_URL:
+        # ffmpeg writes type="dynamic" manifests until the last segment is done; players
+        # need a clock source for those.
+        args.extend(["-utc_timing_url", LIVE_UTC_TIMING_URL])
+    if adaptation_sets:
+        args.extend(["-adaptation_sets", adaptation_sets])
+    # Segment names carry a token unique to this encode, so a re-encoded title never
+    # reuses a segment URL and segments can be cached as immutable.
+    token = uuid.uuid4().hex[:8]
+    args.extend([
+        "-init_seg_name", f"init-{token}-stream$RepresentationID$.m4s",
+        "-media_seg_name", f"chunk-{token}-stream$RepresentationID$-$Number%05d$.m4s",
+        manifest_path,
+    ])
+    return args
+
+
+def build_ffmpeg_command(input_spec, info, manifest_path, options, slot):
+    """The single-pass DASH command, using the thread budget and preset of a scheduler slot."""
+    if info["has_video"]:
+        ffmpeg_command = ["ffmpeg", "-y", "-i", input_spec]
+
+        rungs = select_rungs(info, options)
+        copying = any(q["copy"] for q in rungs)
+        # The slot's budget is shared by every encoded rung rather than given to each.
+        threads = iter(split_threads(slot["threads"], max(1, encoded_streams(rungs))))
+        video_maps = []
+        for video_stream_index, q in enumerate(rungs):
+            video_maps.extend(["-map", "0:v:0"])
+            ffmpeg_command.extend(video_rung_args(video_stream_index, q, copying, slot["preset"],
+                                                  None if q["copy"] else next(threads)))
+
+        ffmpeg_command.extend(video_maps)
+
+        ffmpeg_command.extend(["-map", "0:a:0?"])
+        ffmpeg_command.extend(audio_codec_args(info, options))
+
+        ffmpeg_command.extend(dash_output_args(manifest_path, options, "id=0,streams=v id=1,streams=a"))
+
+    else:
+        ffmpeg_command = ["ffmpeg", "-y", "-i", input_spec]
+        ffmpeg_command.extend(audio_codec_args(info, options, ":a"))
+        ffmpeg_command.append("-vn")
+        ffmpeg_command.extend(["-threads", str(slot["threads"])])
+        ffmpeg_command.extend(dash_output_args(manifest_path, options))
+    return ffmpeg_command
+
+
+def find_keyframes(input_path, start_time=0.0):
+    """Keyframe timestamps of the first video stream, relative to the start of the file."""
+    probe_command = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        input_path,
+    ]
+    probe_result = subprocess.run(probe_command, capture_output=True, text=True, check=True)
+    keyframes = []
+    for line in probe_result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time) - start_time)
+    return sorted(keyframes)
+
+
+def split_points(duration, parts, keyframes=None):
+    """Start times of up to `parts` ranges, each on the segment boundary nearest an even split.
+
+    Segment boundaries are SEGMENT_DURATION multiples, where every encode forces a
+    keyframe, so the stitched output is cut exactly like a single-pass one. With a
+    remuxed rung the boundaries are the source's `keyframes` instead.
+    """
+    if keyframes is None:
+        step = float(SEGMENT_DURATION)
+        keyframes = [i * step for i in range(1, int(duration // step) + 1) if i * step < duration]
+    starts = [0.0]
+    for i in range(1, parts):
+        target = duration * i / parts
+        candidates = [k for k in keyframes if k > starts[-1]]
+        if not candidates:
+            break
+        starts.append(min(candidates, key=lambda k: abs(k - target)))
+    return starts
+
+
+def parallel_parts(info, options):
+    # Live publishing needs segments in order as they are produced, which a range-parallel
+    # encode (packaged only at the end) cannot give.
+    if not info["has_video"] or options.get("live") or options.get("parallel_segments", 0) < 2:
+        return 0
+    if all(q["copy"] for q in select_rungs(info, options)):
+        return 0
+    return min(options["parallel_segments"], int(info["duration"] // PARALLEL_MIN_RANGE))
+
+
+def encode_range(input_path, index, start, end, rungs, work_dir, share, job=None):
+    """Encode one time range of the source to every rung that is not remuxed, video only.
+
+    `share` is the number of ranges encoded side by side, so each one books at most its
+    fair share of the cores even before its siblings have started.
+    """
+    slot = scheduler.acquire(share, streams=encoded_streams(rungs))
+    threads = iter(split_threads(slot["threads"], encoded_streams(rungs)))
+    ffmpeg_command = ["ffmpeg", "-y", "-ss", f"{start:.6f}"]
+    if end is not None:
+        ffmpeg_command.extend(["-t", f"{end - start:.6f}"])
+    ffmpeg_command.extend(["-i", input_path])
+    # With a remuxed rung, ranges start on source keyframes, so "source" lines up with it.
+    # Otherwise keyframes go on absolute SEGMENT_DURATION multiples, as in a single pass.
+    force_key_frames = "source" if any(q["copy"] for q in rungs) else segment_keyframes(start)
+    outputs = []
+    for rung, q in enumerate(rungs):
+        if q["copy"]:
+            outputs.append(None)
+            continue
+        output = os.path.join(work_dir, f"range{index:04d}-rung{rung}.mp4")
+        ffmpeg_command.extend([
+            "-map", "0:v:0", "-an",
+            "-c:v", "libx264",
+            "-preset", slot["preset"],
+            "-b:v", q["bitrate"],
+            "-s", f"{q['width']}x{q['height']}",
+            "-threads", str(next(threads)),
+            "-force_key_frames", force_key_frames,
+            output,
+        ])
+        outputs.append(output)
+    try:
+        run_ffmpeg(ffmpeg_command, work_dir, job=job, stage=f"range{index}",
+                   duration=(end - start) if end is not None else 0.0, slot=slot)
+    finally:
+        scheduler.release(slot)
+    return outputs
+
+
+def encode_dash_parallel(input_path, info, parts, dash_dir, manifest_path, options, job=None):
+    """Encode keyframe-aligned time ranges concurrently, then package them in one DASH pass.
+
+    Each range is encoded by its own ffmpeg process. The per-rung pieces are joined with
+    the concat demuxer and stream-copied into the DASH muxer together with the audio,
+    which is encoded once from the source, so the manifest timeline is continuous. A
+    remuxed rung is copied straight from the source in that final pass.
+    """
+    rungs = select_rungs(info, options)
+    keyframes = find_keyframes(input_path, info["start_time"]) if any(q["copy"] for q in rungs) else None
+    starts = split_points(info["duration"], parts, keyframes)
+    ends = starts[1:] + [None]
+    work_dir = os.path.join(os.path.dirname(dash_dir), "ranges")
+    os.makedirs(work_dir, exist_ok=True)
+    print(f"Parallel encode: {len(starts)} ranges starting at {[round(s, 3) for s in starts]}")
+
+    with ThreadPoolExecutor(max_workers=len(starts)) as pool:
+        futures = [
+            pool.submit(encode_range, input_path, i, start, end, rungs, work_dir, len(starts), job)
+            for i, (start, end) in enumerate(zip(starts, ends))
+        ]
+        outputs = [future.result() for future in futures]
+
+    ffmpeg_command = ["ffmpeg", "-y"]
+    encoded = [rung for rung, q in enumerate(rungs) if not q["copy"]]
+    for rung in encoded:
+        list_path = os.path.join(work_dir, f"rung{rung}.txt")
+        with open(list_path, "w") as list_file:
+            for range_outputs in outputs:
+                list_file.write(f"file '{range_outputs[rung]}'\n")
+        ffmpeg_command.extend(["-f", "concat", "-safe", "0", "-i", list_path])
+    source_index = len(encoded)
+    ffmpeg_command.extend(["-i", input_path])
+    for rung, q in enumerate(rungs):
+        input_index = source_index if q["copy"] else encoded.index(rung)
+        ffmpeg_command.extend(["-map", f"{input_index}:v:0"])
+    ffmpeg_command.extend(["-map", f"{source_index}:a:0?", "-c:v", "copy"])
+    ffmpeg_command.extend(audio_codec_args(info, options))
+    slot = scheduler.acquire()
+    ffmpeg_command.extend(["-threads", str(slot["threads"])])
+    ffmpeg_command.extend(dash_output_args(manifest_path, options, "id=0,streams=v id=1,streams=a"))
+    try:
+        stderr = run_ffmpeg(ffmpeg_command, dash_dir, job=job, stage="package", duration=info["duration"], slot=slot)
+    finally:
+        scheduler.release(slot)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return stderr
+
+
+class CpuScheduler:
+    """Hands out encoder thread budgets, x264 presets and (optionally) cores per ffmpeg.
+
+    A new process gets an equal share of the cores with the processes already running,
+    so concurrent encodes stop oversubscribing the box. Threads of a running ffmpeg
+    cannot be taken back, so under sustained oversubscription (or outside load) new
+    encodes fall back to faster presets instead, which keeps total throughput up at
+    some cost in compression efficiency.
+    """
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.core_load = [0] * cores
+        self.slots = []
+        self.lock = threading.Lock()
+
+    def pressure(self, booked=0):
+        """Load per core: booked encoder threads or the 1-minute load average, whichever is higher."""
         try:
-            probe_command = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=height",
-                "-of", "default=nw=1:nk=1",
-                input_path,
-            ]
-            probe_result = subprocess.run(probe_command, capture_output=True, text=True, check=True)
-            if probe_result.stdout.strip():
-                has_video = True
-                source_height = int(probe_result.stdout.strip())
-                print(f"Video detected. Source height: {source_height}p")
-
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            print("No video stream found or ffprobe failed. Assuming audio-only.")
-            has_video = False
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            load = 0.0
+        return max(load, booked) / self.cores
+
+    def choose_preset(self, pressure):
+        if ADAPTIVE_PRESET:
+            for threshold, preset in LOAD_PRESETS:
+                if pressure > threshold:
+                    return preset
+        return X264_PRESET
 
+    def acquire(self, share=1, streams=1):
+        """Book a slot for one ffmpeg process; `share` is how many siblings start with it.
+
+        The slot's threads are the process's total, to be split between its `streams`
+        video encoders; every encoder needs at least one.
+        """
+        with self.lock:
+            demand = max(share, len(self.slots) + 1)
+            threads = max(streams, min(MAX_ENCODE_THREADS, self.cores // demand))
+            cores = sorted(range(self.cores), key=lambda core: self.core_load[core])[:threads]
+            for core in cores:
+                self.core_load[core] += 1
+            booked = sum(slot["threads"] for slot in self.slots) + threads
+            slot = {
+                "threads": threads,
+                "preset": self.choose_preset(self.pressure(booked)),
+                "cores": sorted(cores),
+            }
+            self.slots.append(slot)
+        return slot
+
+    def release(self, slot):
+        with self.lock:
+            self.slots.remove(slot)
+            for core in slot["cores"]:
+                self.core_load[core] -= 1
+
+    def affinity_prefix(self, slot):
+        """Command prefix pinning a process to its slot's cores, or nothing when affinity is off."""
+        if not CPU_AFFINITY:
+            return []
+        return ["taskset", "-c", ",".join(str(core) for core in slot["cores"])]
+
+    def stats(self):
+        with self.lock:
+            booked = sum(slot["threads"] for slot in self.slots)
+            return {
+                "cores": self.cores,
+                "processes": len(self.slots),
+                "threads_booked": booked,
+                "pressure": round(self.pressure(booked), 3),
+                "next_preset": self.choose_preset(self.pressure(booked)),
+                "affinity": CPU_AFFINITY,
+            }
+
+
+scheduler = CpuScheduler(CPU_CORES)
+
+
+class EncodeProgress:
+    """Live view of one ffmpeg process, fed from its -progress output."""
+
+    def __init__(self, job, stage, duration, slot=None):
+        self.job = job
+        self.stage = stage
+        self.duration = duration
+        self.slot = slot
+        self.started_at = time.time()
+        self.values = {}
+
+    def update(self, line):
+        key, sep, value = line.partition("=")
+        if sep:
+            self.values[key.strip()] = value.strip()
+
+    def to_dict(self):
+        out_time = parse_float(self.values.get("out_time_us")) / 1_000_000
+        speed = parse_float(self.values.get("speed", "").rstrip("x"))
+        eta = None
+        if self.duration and speed:
+            eta = max(0.0, (self.duration - out_time) / speed)
+        # ffmpeg's own bitrate= is N/A for the DASH muxer, so derive it from the bytes
+        # written; when total_size is N/A too, report nothing rather than 0.
+        total_size = parse_float(self.values.get("total_size"))
+        bitrate_kbps = round(total_size * 8 / out_time / 1000, 1) if total_size > 0 and out_time > 0 else None
+        return {
+            "job_id": self.job.id if self.job else None,
+            "filename": self.job.filename if self.job else None,
+            "stage": self.stage,
+            "frame": int(parse_float(self.values.get("frame"))),
+            "fps": parse_float(self.values.get("fps")),
+            "speed": speed,
+            "bitrate_kbps": bitrate_kbps,
+            "out_time": out_time,
+            "duration": self.duration,
+            "progress": min(1.0, out_time / self.duration) if self.duration else None,
+            "eta": eta,
+            "elapsed": time.time() - self.started_at,
+            "threads": self.slot["threads"] if self.slot else None,
+            "preset": self.slot["preset"] if self.slot else None,
+        }
+
+
+def run_ffmpeg(ffmpeg_command, cwd, stdin_chunks=None, job=None, stage="encode", duration=0.0, slot=None):
+    """Run ffmpeg, optionally feeding its stdin from `stdin_chunks`, and return its stderr tail.
+
+    When a job is given, the process is attached to it so it can be killed on cancel.
+    Progress is read from ffmpeg's -progress output while it runs, and only the last
+    STDERR_TAIL_LINES lines of stderr are kept. A scheduler slot pins the process to
+    the slot's cores when CPU affinity is enabled.
+    """
+    if job is not None and job.cancel_requested:
+        raise JobCancelled()
+    ffmpeg_command = ffmpeg_command[:1] + ["-progress", "pipe:1", "-nostats"] + ffmpeg_command[1:]
+    if slot is not None:
+        ffmpeg_command = scheduler.affinity_prefix(slot) + ffmpeg_command
+    print(f"Running FFmpeg command: {' '.join(ffmpeg_command)}")
+    process = subprocess.Popen(
+        ffmpeg_command,
+        cwd=cwd,
+        stdin=subprocess.PIPE if stdin_chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if job is not None:
+        job.processes.add(process)
+        if job.cancel_requested:
+            process.kill()
+
+    progress = EncodeProgress(job, stage, duration, slot)
+    with encodes_lock:
+        active_encodes.add(progress)
+
+    # Both pipes are drained on their own threads so a chatty ffmpeg never blocks on a
+    # full pipe while we are still writing its input.
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    readers = [
+        threading.Thread(target=lambda: stderr_tail.extend(iter(process.stderr.readline, b"")), daemon=True),
+        threading.Thread(target=lambda: [progress.update(line.decode(errors="replace"))
+                                         for line in iter(process.stdout.readline, b"")], daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    try:
+        if stdin_chunks is not None:
+            try:
+                for chunk in stdin_chunks:
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                print("FFmpeg closed its input early")
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+    finally:
+        with encodes_lock:
+            active_encodes.discard(progress)
+        if job is not None:
+            job.processes.discard(process)
+
+    stats = progress.to_dict()
+    with encodes_lock:
+        encode_totals["processes"] += 1
+        encode_totals["failed"] += returncode != 0
+        encode_totals["wall_seconds"] += stats["elapsed"]
+        encode_totals["media_seconds"] += stats["out_time"]
+    print(f"FFmpeg {stage} finished: {stats['frame']} frames, {stats['out_time']:.1f}s of media "
+          f"in {stats['elapsed']:.1f}s ({stats['speed']}x)")
+
+    stderr = b"".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ffmpeg_command, stderr=stderr)
+    return stderr
+
+
+def ingest(chunks, input_path, require_file=False):
+    """Work out how to feed an upload to ffmpeg.
+
+    Returns (input_spec, info, stdin_chunks). Streamable uploads are piped straight into
+    ffmpeg as they arrive; uploads that need seeking (or `require_file`) are spooled to
+    `input_path` first. With `chunks=None` the upload is already on disk at `input_path`.
+    """
+    if chunks is None:
+        return input_path, probe_file(input_path), None
+
+    head = read_head(chunks, PROBE_HEAD_BYTES)
+    if not head:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+
+    if not require_file and not needs_seekable_input(head):
         try:
-            if has_video:
-                ffmpeg_command = ["ffmpeg", "-y", "-i", input_path]
-                
-                qualities = [
-                    {"height": 360, "width": 640, "bitrate": "800k"},
-                    {"height": 720, "width": 1280, "bitrate": "2000k"}
-                ]
-
-                video_maps = []
-                video_stream_index = 0
-                
-                for q in qualities:
-                    if source_height >= q["height"]:
-                        video_maps.extend(["-map", "0:v:0"])
-                        ffmpeg_command.extend([
-                            f"-c:v:{video_stream_index}", "libx264",
-                            f"-b:v:{video_stream_index}", q["bitrate"],
-                            f"-s:v:{video_stream_index}", f"{q['width']}x{q['height']}"
-                        ])
-                        video_stream_index += 1
-                
-                if not video_maps:
-                    q = qualities[0] 
-                    video_maps.extend(["-map", "0:v:0"])
-                    ffmpeg_command.extend([
-                        f"-c:v:0", "libx264",
-                        f"-b:v:0", q["bitrate"],
-                        f"-s:v:0", f"{q['width']}x{q['height']}"
-                    ])
-                    print(f"Warning: Source height ({source_height}p) is low. Defaulting to one output stream at {q['height']}p.")
-
-                ffmpeg_command.extend(video_maps)
-
-                ffmpeg_command.extend([
-                    "-map", "0:a:0?",
-                    "-c:a:0", "aac",
-                    "-b:a:0", "128k"
-                ])
-                
-                adaptation_sets = "id=0,streams=v id=1,streams=a"
-                ffmpeg_command.extend([
-                    "-f", "dash",
-                    "-seg_duration", "4",
-                    "-use_template", "1",
-                    "-use_timeline", "1",
-                    "-adaptation_sets", adaptation_sets,
-                    "-init_seg_name", "init-stream$RepresentationID$.m4s",
-                    "-media_seg_name", "chunk-stream$RepresentationID$-$Number%05d$.m4s",
-                    manifest_path,
-                ])
+            info = probe_media("pipe:0", stdin_data=head)
+            print(f"Streaming ingest. Video: {info['has_video']}, source height: {info['height']}p")
+            return "pipe:0", info, chain([head], chunks)
+        except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+            print("Could not probe the start of the upload, spooling to disk")
+
+    print(f"Spooling upload to {input_path}")
+    with open(input_path, "wb") as buffer:
+        buffer.write(head)
+        for chunk in chunks:
+            buffer.write(chunk)
+
+    return input_path, probe_file(input_path), None
+
+
+def probe_file(input_path):
+    try:
+        info = probe_media(input_path)
+        if info["has_video"]:
+            print(f"Video detected. Source height: {info['height']}p")
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        print("No video stream found or ffprobe failed. Assuming audio-only.")
+        info = audio_only_info()
+    return info
+
+
+def upload_path(temp_dir, filename):
+    return os.path.join(temp_dir, os.path.basename(filename))
+
+
+def publish_dir(filename):
+    """Directory a title is published to in live mode (LIVE_PUBLISH_ROOT/<base name>)."""
+    if not LIVE_PUBLISH_ROOT:
+        raise HTTPException(status_code=400, detail="Live publishing is not configured (set LIVE_PUBLISH_ROOT)")
+    base_name, _ = os.path.splitext(os.path.basename(filename))
+    if not base_name or base_name.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Invalid media name: {filename}")
+    return os.path.join(LIVE_PUBLISH_ROOT, base_name)
+
+
+def live_version_dir(target_dir):
+    """A new hidden sibling of a live title's directory to encode or copy a version into.
+
+    Published titles are symlinks to their current version, so a replacement can be
+    prepared next to the old one and swapped in with one rename.
+    """
+    parent, name = os.path.split(target_dir)
+    return os.path.join(parent, f".{name}.{uuid.uuid4().hex[:8]}")
+
+
+def swap_in(target_dir, version_dir):
+    """Point a live title at `version_dir`. Returns the directory it served before, or None.
+
+    A title that is still a plain directory (published before versions existed) is
+    renamed aside first, leaving a moment in which it is missing.
+    """
+    previous = None
+    if os.path.islink(target_dir):
+        previous = os.path.join(os.path.dirname(target_dir), os.readlink(target_dir))
+    elif os.path.isdir(target_dir):
+        previous = live_version_dir(target_dir)
+        os.rename(target_dir, previous)
+    link = version_dir + ".link"
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, target_dir)
+    return previous
+
+
+def restore_live(target_dir, previous):
+    """Put back the version a failed replacement had swapped out (or unpublish a new title)."""
+    if previous:
+        swap_in(target_dir, previous)
+    elif os.path.islink(target_dir):
+        os.remove(target_dir)
+
+
+class LiveSwap(threading.Thread):
+    """Swaps a live title over to a new version as soon as its first manifest is written.
+
+    Until then viewers keep the old version. ffmpeg writes the manifest to a temporary
+    name and renames it, so once it exists it is complete.
+    """
+
+    def __init__(self, target_dir, version_dir):
+        super().__init__(daemon=True)
+        self.target_dir = target_dir
+        self.version_dir = version_dir
+        self.stopped = threading.Event()
+        self.swapped = False
+        self.previous = None
+
+    def run(self):
+        while not self.stopped.wait(LIVE_SWAP_POLL_INTERVAL):
+            if os.path.exists(os.path.join(self.version_dir, "manifest.mpd")):
+                self.swap()
+                return
+
+    def swap(self):
+        self.previous = swap_in(self.target_dir, self.version_dir)
+        self.swapped = True
+        print(f"Live title {self.target_dir} now serving {self.version_dir}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def publish_copy(source_dir, target_dir):
+    """Copy a finished package into a new version of a live title, then swap it in."""
+    version_dir = live_version_dir(target_dir)
+    try:
+        shutil.copytree(source_dir, version_dir)
+        previous = swap_in(target_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def sample_windows(info):
+    """Start times and length of the windows the ladder analysis encodes.
+
+    Start times count from the start of the file, as ffmpeg's input -ss does (it adds
+    the stream's start_time itself).
+    """
+    duration = info["duration"]
+    if duration <= LADDER_SAMPLE_WINDOWS * LADDER_SAMPLE_SECONDS:
+        return [0.0], duration or LADDER_SAMPLE_SECONDS
+    starts = [
+        (i + 0.5) * duration / LADDER_SAMPLE_WINDOWS - LADDER_SAMPLE_SECONDS / 2
+        for i in range(LADDER_SAMPLE_WINDOWS)
+    ]
+    return starts, LADDER_SAMPLE_SECONDS
+
+
+def choose_ladder(probe_kbps, info):
+    """Rungs (shaped like QUALITIES) for a title whose test encode came out at `probe_kbps`."""
+    probe_width, probe_height = LADDER_PROBE_SIZE
+    candidates = [c for c in LADDER_CANDIDATES if c["height"] <= info["height"]] or LADDER_CANDIDATES[:1]
+    ladder = []
+    for c in reversed(candidates):
+        scale = (c["width"] * c["height"] / (probe_width * probe_height)) ** LADDER_SCALING_EXPONENT
+        kbps = int(min(c["max_kbps"], max(c["min_kbps"], probe_kbps * LADDER_BITRATE_SCALE * scale)))
+        if ladder:
+            lowest_kbps = parse_bitrate(ladder[0]["bitrate"]) // 1000
+            if lowest_kbps <= LADDER_FLOOR_KBPS:
+                break
+            if kbps * LADDER_MIN_STEP > lowest_kbps:
+                continue
+        ladder.insert(0, {"height": c["height"], "width": c["width"], "bitrate": f"{kbps}k"})
+    return ladder
+
+
+def analyze_ladder(input_path, info, temp_dir, job=None):
+    """Pick a per-title ladder from one CRF test encode of a few sampled windows.
+
+    The windows are scaled down to LADDER_PROBE_SIZE, joined and encoded in a single
+    ultrafast pass; the bitrate that comes out measures the title's complexity.
+    Returns the analysis record written to ladder.json, with the rungs under "ladder".
+    """
+    starts, length = sample_windows(info)
+    probe_width, probe_height = LADDER_PROBE_SIZE
+    ffmpeg_command = ["ffmpeg", "-y"]
+    for start in starts:
+        ffmpeg_command.extend(["-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", input_path])
+    scaled = "".join(f"[{i}:v:0]scale={probe_width}:{probe_height},setsar=1[v{i}];" for i in range(len(starts)))
+    joined = "".join(f"[v{i}]" for i in range(len(starts)))
+    output = os.path.join(temp_dir, "ladder_probe.h264")
+
+    slot = scheduler.acquire()
+    ffmpeg_command.extend([
+        "-filter_complex", f"{scaled}{joined}concat=n={len(starts)}:v=1:a=0[probe]",
+        "-map", "[probe]",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(LADDER_PROBE_CRF),
+        "-threads", str(slot["threads"]),
+        "-f", "h264", output,
+    ])
+    try:
+        run_ffmpeg(ffmpeg_command, temp_dir, job=job, stage="analysis", duration=length * len(starts), slot=slot)
+    finally:
+        scheduler.release(slot)
+    probe_kbps = os.path.getsize(output) * 8 / (length * len(starts)) / 1000
+    os.remove(output)
+
+    ladder = choose_ladder(probe_kbps, info)
+    print(f"Ladder analysis: test encode at {probe_kbps:.0f} kbps, rungs "
+          f"{[(q['height'], q['bitrate']) for q in ladder]}")
+    return {
+        "probe": {
+            "windows": [round(start, 3) for start in starts],
+            "window_seconds": length,
+            "size": f"{probe_width}x{probe_height}",
+            "crf": LADDER_PROBE_CRF,
+            "kbps": round(probe_kbps, 1),
+        },
+        "source": {"width": info["width"], "height": info["height"], "video_bitrate": info["video_bitrate"]},
+        "ladder": ladder,
+    }
+
+
+def encode_dash(chunks, filename, temp_dir, options, job=None, dash_dir=None):
+    """Ingest an upload and encode it to DASH. Returns the directory holding the manifest.
+
+    In live mode encode_live() passes a version directory of the published title, so
+    players can start on the dynamic manifest while the encode is still running.
+    """
+    if dash_dir is None:
+        dash_dir = os.path.join(temp_dir, "dash_output")
+    os.makedirs(dash_dir, exist_ok=True)
+    manifest_path = os.path.join(dash_dir, "manifest.mpd")
+
+    # Range-parallel encoding and the ladder analysis have to seek in the source, so they
+    # need the upload on disk.
+    require_file = options.get("parallel_segments", 0) > 1 or options.get("adaptive_ladder", False)
+    input_spec, info, stdin_chunks = ingest(chunks, upload_path(temp_dir, filename), require_file=require_file)
+
+    try:
+        if options.get("adaptive_ladder") and info["has_video"]:
+            analysis = analyze_ladder(input_spec, info, temp_dir, job=job)
+            info["ladder"] = analysis["ladder"]
+            with open(os.path.join(dash_dir, LADDER_FILE_NAME), "w") as ladder_file:
+                json.dump(analysis, ladder_file, indent=2)
+        parts = parallel_parts(info, options) if stdin_chunks is None else 0
+        if parts > 1:
+            stderr = encode_dash_parallel(input_spec, info, parts, dash_dir, manifest_path, options, job=job)
+        else:
+            streams = encoded_streams(select_rungs(info, options)) if info["has_video"] else 1
+            slot = scheduler.acquire(streams=max(1, streams))
+            try:
+                ffmpeg_command = build_ffmpeg_command(input_spec, info, manifest_path, options, slot)
+                stderr = run_ffmpeg(ffmpeg_command, dash_dir, stdin_chunks, job=job, duration=info["duration"],
+                                    slot=slot)
+            finally:
+                scheduler.release(slot)
+        print("FFmpeg completed successfully")
+
+        if stderr:
+            print(f"FFmpeg warnings/info: {stderr}")
+
+    except subprocess.CalledProcessError as e:
+        if job is not None and job.cancel_requested:
+            raise JobCancelled()
+        print(f"FFmpeg error: {e}")
+        print(f"FFmpeg stderr: {e.stderr}")
+        raise HTTPException(status_code=500, detail=f"Video processing failed: {e.stderr}")
+
+    if not os.path.exists(manifest_path):
+        raise HTTPException(status_code=500, detail="Manifest file was not created")
+
+    created_files = []
+    for root, dirs, files in os.walk(dash_dir):
+        for f in files:
+            file_path = os.path.join(root, f)
+            rel_path = os.path.relpath(file_path, dash_dir)
+            created_files.append(rel_path)
 
+    print(f"Created DASH files: {created_files}")
+
+    if len(created_files) <= 1:
+        raise HTTPException(status_code=500, detail="No DASH segments were created")
+
+    return dash_dir
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    dos_date = (max(t.tm_year, 1980) - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return dos_time, dos_date
+
+
+def iter_zip_stream(dash_dir):
+    """Yield a zip archive of `dash_dir` piece by piece, without building it anywhere.
+
+    Media segments are already compressed, so they are stored; only the small text
+    files (manifests) are deflated. Sizes and CRCs are written into the local headers
+    rather than trailing data descriptors, so the archive can also be unpacked as a
+    stream. Offsets past 4 GiB switch the central directory to zip64.
+    """
+    entries = []
+    offset = 0
+
+    for root, dirs, files in os.walk(dash_dir):
+        for f in sorted(files):
+            file_path = os.path.join(root, f)
+            arc_name = os.path.relpath(file_path, dash_dir).replace(os.sep, "/").encode()
+            dos_time, dos_date = dos_datetime(os.path.getmtime(file_path))
+
+            if os.path.splitext(f)[1].lower() in STORED_EXTENSIONS:
+                method = zipfile.ZIP_STORED
+                crc = 0
+                size = 0
+                with open(file_path, "rb") as src:
+                    for block in iter(lambda: src.read(ZIP_BLOCK_SIZE), b""):
+                        crc = zlib.crc32(block, crc)
+                        size += len(block)
+                compressed_size = size
+                data = None
             else:
-                ffmpeg_command = [
-                    "ffmpeg", "-y",
-                    "-i", input_path,
-                    "-c:a", "aac",
-                    "-b:a", "128k",
-                    "-vn",
-                    "-f", "dash",
-                    "-seg_duration", "4",
-                    "-use_template", "1",
-                    "-use_timeline", "1",
-                    "-init_seg_name", "init-stream$RepresentationID$.m4s",
-                    "-media_seg_name", "chunk-stream$RepresentationID$-$Number%05d$.m4s",
-                    manifest_path,
-                ]
-
-            print(f"Running FFmpeg command: {' '.join(ffmpeg_command)}")
-            result = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=True, cwd=dash_dir)
-            print("FFmpeg completed successfully")
-
-            if result.stderr:
-                print(f"FFmpeg warnings/info: {result.stderr}")
-
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error: {e}")
-            print(f"FFmpeg stderr: {e.stderr}")
-            print(f"FFmpeg stdout: {e.stdout}")
-            raise HTTPException(status_code=500, detail=f"Video processing failed: {e.stderr}")
-        
-        if not os.path.exists(manifest_path):
-            raise HTTPException(status_code=500, detail="Manifest file was not created")
-        
-        created_files = []
-        for root, dirs, files in os.walk(dash_dir):
-            for f in files:
-                file_path = os.path.join(root, f)
-                rel_path = os.path.relpath(file_path, dash_dir)
-                created_files.append(rel_path)
-        
-        print(f"Created DASH files: {created_files}")
-        
-        if len(created_files) <= 1:
-            raise HTTPException(status_code=500, detail="No DASH segments were created")
-        
-        zip_path = os.path.join(temp_dir, f"{base_name}.zip")
-        
-        try:
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(dash_dir):
-                    for f in files:
-                        file_to_zip = os.path.join(root, f)
-                        arc_path = os.path.relpath(file_to_zip, dash_dir)
-                        zipf.write(file_to_zip, arc_path)
-            
-            print(f"Created zip file: {zip_path} ({os.path.getsize(zip_path)} bytes)")
-            
-        except Exception as e:
-            print(f"Error creating zip: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to create zip file: {e}")
-        
-        with open(zip_path, "rb") as zip_file:
-            zip_content = zip_file.read()
-        
-        print(f"Read {len(zip_content)} bytes from zip file")
-        
-        return Response(
-            content=zip_content,
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename={base_name}.zip"}
+                method = zipfile.ZIP_DEFLATED
+                with open(file_path, "rb") as src:
+                    raw = src.read()
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+                data = compressor.compress(raw) + compressor.flush()
+                crc = zlib.crc32(raw)
+                size = len(raw)
+                compressed_size = len(data)
+
+            if size > ZIP64_LIMIT:
+                # zip_response() checks sizes before streaming, so this only happens if the
+                # file grew since. Headers are already sent: abort the connection rather
+                # than finish a truncated 200.
+                print(f"Aborting zip stream: {f} grew past {ZIP64_LIMIT} bytes")
+                raise RuntimeError(f"{f} is too large to stream as a zip entry")
+
+            header = struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, 0, method, dos_time, dos_date,
+                crc, compressed_size, size, len(arc_name), 0,
+            ) + arc_name
+            entries.append((arc_name, method, dos_time, dos_date, crc, compressed_size, size, offset))
+            yield header
+            offset += len(header)
+
+            if data is not None:
+                yield data
+            else:
+                with open(file_path, "rb") as src:
+                    for block in iter(lambda: src.read(ZIP_BLOCK_SIZE), b""):
+                        yield block
+            offset += compressed_size
+
+    central_directory_offset = offset
+    central_directory_size = 0
+    for arc_name, method, dos_time, dos_date, crc, compressed_size, size, header_offset in entries:
+        extra = b""
+        version = 20
+        if header_offset > ZIP64_LIMIT:
+            extra = struct.pack("<HHQ", 0x0001, 8, header_offset)
+            header_offset = 0xFFFFFFFF
+            version = 45
+        record = struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, 3 << 8 | version, version, 0, method,
+            dos_time, dos_date, crc, compressed_size, size, len(arc_name), len(extra),
+            0, 0, 0, 0o100644 << 16, header_offset,
+        ) + arc_name + extra
+        central_directory_size += len(record)
+        yield record
+
+    end_offset = central_directory_offset + central_directory_size
+    count = len(entries)
+    if central_directory_offset > ZIP64_LIMIT or count >= 0xFFFF:
+        yield struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0,
+            count, count, central_directory_size, central_directory_offset,
         )
-        
+        yield struct.pack("<IIQI", 0x07064B50, 0, end_offset, 1)
+    yield struct.pack(
+        "<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+        min(central_directory_size, 0xFFFFFFFF), min(central_directory_offset, 0xFFFFFFFF), 0,
+    )
+
+
+def oversized_zip_entries(dash_dir):
+    """Files iter_zip_stream() cannot store (local headers carry 32-bit sizes)."""
+    oversized = []
+    for root, dirs, files in os.walk(dash_dir):
+        for f in files:
+            if os.path.getsize(os.path.join(root, f)) > ZIP64_LIMIT:
+                oversized.append(f)
+    return oversized
+
+
+def zip_response(dash_dir, base_name, background=None):
+    """Stream `dash_dir` as a zip, after checking it can be, so errors still become HTTP errors."""
+    oversized = oversized_zip_entries(dash_dir)
+    if oversized:
+        if background is not None:
+            # The response never starts, so its cleanup has to run here.
+            background.func(*background.args, **background.kwargs)
+        raise HTTPException(status_code=500, detail=f"{', '.join(oversized)} too large to stream as a zip entry")
+    return StreamingResponse(
+        iter_zip_stream(dash_dir),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={base_name}.zip"},
+        background=background,
+    )
+
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+class TranscodeCache:
+    """Size-bounded LRU store of finished DASH packages, one directory per cache key.
+
+    Entries handed out by acquire()/store() are pinned until release(), so an entry is
+    never evicted while it is being streamed to a client.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.pins = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self.load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def load(self):
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("."):
+                # Leftovers of an interrupted store or eviction.
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isdir(path):
+                found.append((os.path.getmtime(path), name, dir_size(path)))
+        # Directory mtimes are bumped on every hit, so they restore the LRU order.
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total_bytes += size
+        print(f"Transcode cache: {len(self.entries)} entries, {self.total_bytes} bytes in {self.root}")
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def acquire(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.pins[key] = self.pins.get(key, 0) + 1
+        os.utime(self.path(key))
+        return self.path(key)
+
+    def count_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def store(self, key, dash_dir):
+        """Move a finished DASH directory into the cache and return its (pinned) path."""
+        size = dir_size(dash_dir)
+        staging = os.path.join(self.root, f".staging-{uuid.uuid4().hex}")
+        shutil.move(dash_dir, staging)
+        with self.lock:
+            if key in self.entries:
+                # An identical upload finished first; keep that copy.
+                discard = [staging]
+            else:
+                os.rename(staging, self.path(key))
+                self.entries[key] = size
+                self.total_bytes += size
+                discard = []
+            self.entries.move_to_end(key)
+            self.pins[key] = self.pins.get(key, 0) + 1
+            discard += self.evict()
+        for path in discard:
+            shutil.rmtree(path, ignore_errors=True)
+        return self.path(key)
+
+    def release(self, key):
+        with self.lock:
+            self.pins[key] -= 1
+            if not self.pins[key]:
+                del self.pins[key]
+            discard = self.evict()
+        for path in discard:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self):
+        """Drop least recently used, unpinned entries until under budget. Call with the lock held."""
+        discard = []
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self.pins:
+                continue
+            # Renamed under the lock, deleted by the caller after releasing it.
+            trash = os.path.join(self.root, f".evicted-{key}")
+            os.rename(self.path(key), trash)
+            discard.append(trash)
+            self.total_bytes -= self.entries.pop(key)
+            self.evictions += 1
+        return discard
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+cache = TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES)
+
+
+class HashingIterator:
+    """Pass chunks through while hashing them; `complete` is set once the source is exhausted."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.sha256 = hashlib.sha256()
+        self.complete = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.complete = True
+            raise
+        self.sha256.update(chunk)
+        return chunk
+
+
+def hash_fileobj(fileobj):
+    sha256 = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(INGEST_CHUNK_SIZE), b""):
+        sha256.update(block)
+    return sha256.hexdigest()
+
+
+def encoder_settings(options):
+    """Everything besides the input bytes that decides what ffmpeg produces."""
+    return {
+        "version": CACHE_FORMAT_VERSION,
+        "qualities": QUALITIES,
+        "segment_duration": SEGMENT_DURATION,
+        "audio_bitrate": AUDIO_BITRATE,
+        # Presets picked under load are not part of the key: a package encoded with a
+        # faster preset is still a valid result for the same input and ladder.
+        "x264_preset": X264_PRESET,
+        # Range-parallel output places keyframes differently from a single pass.
+        "parallel": options.get("parallel_segments", 0) > 1,
+        "remux": options.get("remux", False),
+        "hls": options.get("hls", False),
+        "adaptive_ladder": {
+            "candidates": LADDER_CANDIDATES,
+            "windows": [LADDER_SAMPLE_WINDOWS, LADDER_SAMPLE_SECONDS],
+            "probe": [LADDER_PROBE_SIZE, LADDER_PROBE_CRF],
+            "model": [LADDER_SCALING_EXPONENT, LADDER_BITRATE_SCALE, LADDER_MIN_STEP, LADDER_FLOOR_KBPS],
+        } if options.get("adaptive_ladder") else False,
+    }
+
+
+def cache_key(digest, options):
+    settings = json.dumps({"input": digest, **encoder_settings(options)}, sort_keys=True)
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+
+def encode_cached(chunks, filename, temp_dir, options, digest=None, job=None):
+    """encode_dash() behind the transcode cache.
+
+    When the upload's SHA-256 is known up front a hit skips ffmpeg entirely; otherwise
+    the upload is hashed as it streams through and the result stored under that hash.
+    Returns (dash_dir, cache_key). A key that is not None is pinned and must be released.
+    Live encodes are published rather than cached, but a cache hit is published as well.
+    """
+    if options.get("live"):
+        return encode_live(chunks, filename, temp_dir, options, digest, job), None
+
+    if not cache.enabled:
+        return encode_dash(chunks, filename, temp_dir, options, job=job), None
+
+    if digest:
+        key = cache_key(digest, options)
+        entry = cache.acquire(key)
+        if entry:
+            print(f"Cache hit for {filename}")
+            return entry, key
+    cache.count_miss()
+
+    hasher = None
+    if digest is None and chunks is not None:
+        chunks = hasher = HashingIterator(chunks)
+    dash_dir = encode_dash(chunks, filename, temp_dir, options, job=job)
+    if hasher is not None:
+        if not hasher.complete:
+            # ffmpeg stopped reading early, so the hash does not cover the whole upload.
+            return dash_dir, None
+        digest = hasher.sha256.hexdigest()
+
+    key = cache_key(digest, options)
+    return cache.store(key, dash_dir), key
+
+
+def encode_live(chunks, filename, temp_dir, options, digest=None, job=None):
+    target_dir = publish_dir(filename)
+    if cache.enabled and digest:
+        key = cache_key(digest, options)
+        entry = cache.acquire(key)
+        if entry:
+            print(f"Cache hit for {filename}, publishing the cached package")
+            try:
+                publish_copy(entry, target_dir)
+            finally:
+                cache.release(key)
+            return target_dir
+        cache.count_miss()
+    # The new version is encoded next to the one being served, which stays up until the
+    # new manifest exists and comes back if the encode fails.
+    version_dir = live_version_dir(target_dir)
+    swapper = LiveSwap(target_dir, version_dir)
+    swapper.start()
+    try:
+        encode_dash(chunks, filename, temp_dir, options, job=job, dash_dir=version_dir)
+        swapper.stop()
+        if not swapper.swapped:
+            swapper.swap()
+    except BaseException:
+        # Never leave a dynamic manifest behind that will not be finished.
+        swapper.stop()
+        if swapper.swapped:
+            restore_live(target_dir, swapper.previous)
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    if swapper.previous:
+        shutil.rmtree(swapper.previous, ignore_errors=True)
+    return target_dir
+
+
+def cleanup(temp_dir=None, key=None):
+    if temp_dir:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    if key:
+        cache.release(key)
+
+
+def transcode(chunks, filename, options, digest=None, temp_dir=None):
+    """Encode an upload and return the zip (or, live, the published title).
+
+    With `chunks=None` the upload is already in `temp_dir`, which is then removed along
+    with the rest of the request's files.
+    """
+    temp_dir = temp_dir or tempfile.mkdtemp()
+    try:
+        print(f"Processing {filename} in temporary directory: {temp_dir}")
+
+        base_name, _ = os.path.splitext(filename)
+        # Not queued, but tracked like a job so its progress shows up in /encodes/ and /metrics.
+        job = TranscodeJob(filename, temp_dir, options)
+        job.status = "running"
+        dash_dir, key = encode_cached(chunks, filename, temp_dir, options, digest, job=job)
+
+        if options.get("live"):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return {"status": "published", "media_name": os.path.basename(dash_dir), "manifest": "manifest.mpd"}
+
+        # The zip is written straight onto the socket; the temporary directory is
+        # removed (and the cache entry unpinned) once the response has been sent.
+        return zip_response(dash_dir, base_name, BackgroundTask(cleanup, temp_dir, key))
+
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
     except Exception as e:
         print(f"Unexpected error: {e}")
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class TranscodeJob:
+    def __init__(self, filename, temp_dir, options):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.temp_dir = temp_dir
+        self.options = options
+        self.status = "queued"
+        self.error = None
+        self.dash_dir = None
+        self.cache_key = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.processes = set()
+        self.cancel_requested = False
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "live": self.options.get("live", False),
+            "progress": self.progress(),
+        }
+
+    def progress(self):
+        with encodes_lock:
+            return [encode.to_dict() for encode in active_encodes if encode.job is self]
+
+
+def run_job(job):
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        if job.cancel_requested:
+            raise JobCancelled()
+        print(f"Job {job.id}: processing {job.filename}")
+        input_path = upload_path(job.temp_dir, job.filename)
+        digest = None
+        if cache.enabled:
+            with open(input_path, "rb") as f:
+                digest = hash_fileobj(f)
+        job.dash_dir, job.cache_key = encode_cached(
+            None, job.filename, job.temp_dir, job.options, digest, job=job)
+        os.remove(input_path)
+        job.status = "done"
+    except JobCancelled:
+        job.status = "cancelled"
+    except HTTPException as e:
+        job.status = "failed"
+        job.error = e.detail
+    except Exception as e:
+        print(f"Job {job.id}: unexpected error: {e}")
+        job.status = "failed"
+        job.error = str(e)
     finally:
+        job.finished_at = time.time()
+        print(f"Job {job.id}: {job.status}")
+        if job.status != "done":
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+
+
+def release_job(job):
+    key, job.cache_key = job.cache_key, None
+    cleanup(job.temp_dir, key)
+
+
+def remove_expired_jobs():
+    now = time.time()
+    with jobs_lock:
+        expired = [job for job in jobs.values()
+                   if job.finished_at is not None and now - job.finished_at > JOB_RESULT_TTL]
+        for job in expired:
+            del jobs[job.id]
+    for job in expired:
+        release_job(job)
+
+
+def sweep_expired():
+    """Background loop removing expired jobs (and their output and cache pins) and uploads."""
+    while True:
+        time.sleep(EXPIRY_SWEEP_INTERVAL)
         try:
-            shutil.rmtree(temp_dir)
-            print(f"Cleaned up temporary directory: {temp_dir}")
+            remove_expired_jobs()
+            remove_expired_uploads()
         except Exception as e:
-            print(f"Error cleaning up temp directory: {e}")
+            print(f"Expiry sweep failed: {e}")
+
+
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+def transcode_options(parallel=None, remux=None, live=False, hls=None, adaptive=None):
+    """Per-request encoder options; anything not given falls back to the server defaults."""
+    return {
+        "parallel_segments": PARALLEL_SEGMENTS if parallel is None else parallel,
+        "remux": REMUX_ENABLED if remux is None else remux,
+        "live": live,
+        "hls": HLS_ENABLED if hls is None else hls,
+        "adaptive_ladder": ADAPTIVE_LADDER if adaptive is None else adaptive,
+    }
+
+
+@app.post("/process/")
+async def process_media(file: UploadFile = File(...), queue: bool = False, parallel: int = None,
+                        remux: bool = None, live: bool = False, hls: bool = None, adaptive: bool = None):
+    options = transcode_options(parallel, remux, live, hls, adaptive)
+    if live:
+        publish_dir(file.filename)
+    if queue:
+        return await submit_job(file, options)
+    digest = None
+    if cache.enabled:
+        # The multipart body has already been spooled by the time we get here, so hashing
+        # it first is cheap and lets a cache hit skip the encode.
+        digest = await run_in_threadpool(hash_fileobj, file.file)
+        await file.seek(0)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, transcode, iter_sync(iter_upload(file), loop), file.filename, options, digest)
+
+
+@app.post("/process/stream/")
+async def process_media_stream(request: Request, filename: str, parallel: int = None, remux: bool = None,
+                               live: bool = False, hls: bool = None, adaptive: bool = None,
+                               x_content_sha256: str = Header(None)):
+    """Raw request body upload: ffmpeg starts encoding while the body is still arriving.
+
+    Clients that know the SHA-256 of the body can send it as X-Content-SHA256 so a cached
+    result is returned without reading the body. The result is only ever stored under the
+    hash computed here.
+    """
+    options = transcode_options(parallel, remux, live, hls, adaptive)
+    base_name, _ = os.path.splitext(filename)
+    if live:
+        publish_dir(filename)
+    elif x_content_sha256 and cache.enabled:
+        key = cache_key(x_content_sha256.lower(), options)
+        entry = cache.acquire(key)
+        if entry:
+            print(f"Cache hit for {filename}")
+            return zip_response(entry, base_name, BackgroundTask(cleanup, key=key))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, transcode, iter_sync(request.stream().__aiter__(), loop), filename, options)
+
+
+def check_queue():
+    remove_expired_jobs()
+    with jobs_lock:
+        queued = sum(1 for job in jobs.values() if job.status == "queued")
+    if queued >= TRANSCODE_QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="Transcode queue is full, try again later")
+
+
+def enqueue(job):
+    with jobs_lock:
+        jobs[job.id] = job
+    job.future = executor.submit(run_job, job)
+    print(f"Job {job.id}: queued {job.filename}")
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+async def submit_job(file, options):
+    check_queue()
+    # The upload has to outlive this request, so it is kept in the job's own directory.
+    job = TranscodeJob(file.filename, tempfile.mkdtemp(), options)
+    with open(upload_path(job.temp_dir, file.filename), "wb") as buffer:
+        async for chunk in iter_upload(file):
+            await run_in_threadpool(buffer.write, chunk)
+    return enqueue(job)
+
+
+@app.get("/jobs/")
+async def list_jobs():
+    await run_in_threadpool(remove_expired_jobs)
+    with jobs_lock:
+        return [job.to_dict() for job in jobs.values()]
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = get_job(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    base_name, _ = os.path.splitext(job.filename)
+    return zip_response(job.dash_dir, base_name)
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = get_job(job_id)
+    if job.status in ("queued", "running"):
+        job.cancel_requested = True
+        if job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+        else:
+            for process in list(job.processes):
+                process.kill()
+        return job.to_dict()
+
+    # Finished jobs are dropped together with their result.
+    with jobs_lock:
+        jobs.pop(job.id, None)
+    release_job(job)
+    return job.to_dict()
+
+
+class UploadSession:
+    """A resumable upload: chunks are written at their offsets into a preallocated file."""
+
+    def __init__(self, filename, size):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = upload_path(self.temp_dir, filename)
+        self.received = []
+        self.created_at = self.updated_at = time.time()
+        self.finalized = False
+        self.lock = threading.Lock()
+
+    def preallocate(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, self.size)
+            except (AttributeError, OSError) as e:
+                if getattr(e, "errno", None) == errno.ENOSPC:
+                    raise
+                # Not supported here (or by the filesystem); a sparse file will do.
+                os.ftruncate(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def add_range(self, start, end):
+        """Record [start, end) as received, merging it with the ranges it touches."""
+        with self.lock:
+            merged = []
+            for range_start, range_end in sorted(self.received + [[start, end]]):
+                if merged and range_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_end)
+                else:
+                    merged.append([range_start, range_end])
+            self.received = merged
+            self.updated_at = time.time()
+
+    def received_bytes(self):
+        with self.lock:
+            return sum(end - start for start, end in self.received)
+
+    def next_offset(self):
+        """End of the contiguous run from offset 0, where a sequential client resumes."""
+        with self.lock:
+            if self.received and self.received[0][0] == 0:
+                return self.received[0][1]
+            return 0
+
+    def complete(self):
+        return self.received_bytes() == self.size
+
+    def to_dict(self):
+        with self.lock:
+            received = [list(r) for r in self.received]
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "received": received,
+            "received_bytes": sum(end - start for start, end in received),
+            "next_offset": self.next_offset(),
+            "complete": self.complete(),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+def write_at(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def remove_expired_uploads():
+    now = time.time()
+    with uploads_lock:
+        expired = [session for session in uploads.values() if now - session.updated_at > UPLOAD_SESSION_TTL]
+        for session in expired:
+            del uploads[session.id]
+    for session in expired:
+        print(f"Upload {session.id}: expired")
+        shutil.rmtree(session.temp_dir, ignore_errors=True)
+
+
+def get_upload(upload_id):
+    remove_expired_uploads()
+    with uploads_lock:
+        session = uploads.get(upload_id)
+    if session is None or session.finalized:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    return session
+
+
+@app.post("/uploads/")
+async def create_upload(filename: str, size: int):
+    """Start a resumable upload of `size` bytes; the file is preallocated up front."""
+    remove_expired_uploads()
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {UPLOAD_MAX_BYTES} bytes")
+    session = UploadSession(filename, size)
+    # Registered before preallocating so concurrent sessions count against the caps; no
+    # one can use it before its id is returned.
+    with uploads_lock:
+        reserved = sum(other.size for other in uploads.values())
+        if len(uploads) >= UPLOAD_MAX_SESSIONS:
+            error = HTTPException(status_code=429, detail=f"Too many open uploads ({UPLOAD_MAX_SESSIONS}), try again later")
+        elif reserved + size > UPLOAD_MAX_TOTAL_BYTES:
+            error = HTTPException(status_code=507, detail=f"Open uploads already reserve {reserved} of "
+                                                          f"{UPLOAD_MAX_TOTAL_BYTES} bytes")
+        else:
+            error = None
+            uploads[session.id] = session
+    if error:
+        shutil.rmtree(session.temp_dir, ignore_errors=True)
+        raise error
+    try:
+        await run_in_threadpool(session.preallocate)
+    except OSError as e:
+        with uploads_lock:
+            uploads.pop(session.id, None)
+        shutil.rmtree(session.temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=507, detail=f"Could not allocate {size} bytes: {e}")
+    print(f"Upload {session.id}: {filename}, {size} bytes")
+    return JSONResponse(status_code=201, content=session.to_dict())
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Write the request body at `offset`. Bytes are recorded as they land, so a chunk
+    cut off mid-transfer only has to be resent from where it stopped."""
+    session = get_upload(upload_id)
+    if offset < 0 or offset > session.size:
+        raise HTTPException(status_code=400, detail=f"Offset {offset} is outside the upload")
+    fd = os.open(session.path, os.O_WRONLY)
+    try:
+        position = offset
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if position + len(chunk) > session.size:
+                raise HTTPException(status_code=400, detail=f"Chunk ends past the declared size of {session.size} bytes")
+            await run_in_threadpool(write_at, fd, chunk, position)
+            session.add_range(position, position + len(chunk))
+            position += len(chunk)
+    finally:
+        os.close(fd)
+    return session.to_dict()
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    return get_upload(upload_id).to_dict()
+
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, queue: bool = False, parallel: int = None, remux: bool = None,
+                          live: bool = False, hls: bool = None, adaptive: bool = None):
+    """Transcode a completed upload. Same options and responses as /process/."""
+    session = get_upload(upload_id)
+    if not session.complete():
+        raise HTTPException(status_code=409, detail={"message": "Upload is incomplete", **session.to_dict()})
+    options = transcode_options(parallel, remux, live, hls, adaptive)
+    if live:
+        publish_dir(session.filename)
+    if queue:
+        check_queue()
+    with uploads_lock:
+        if session.finalized:
+            raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+        session.finalized = True
+        uploads.pop(session.id, None)
+    print(f"Upload {session.id}: finalized")
+
+    # The upload file becomes the job's input; it already sits where run_job looks for it.
+    if queue:
+        return enqueue(TranscodeJob(session.filename, session.temp_dir, options))
+    digest = None
+    if cache.enabled:
+        with open(session.path, "rb") as f:
+            digest = await run_in_threadpool(hash_fileobj, f)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, transcode, None, session.filename, options, digest, session.temp_dir)
+
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    session = get_upload(upload_id)
+    with uploads_lock:
+        uploads.pop(session.id, None)
+    shutil.rmtree(session.temp_dir, ignore_errors=True)
+    return {"upload_id": session.id, "status": "aborted"}
+
+
+@app.get("/encodes/")
+async def list_encodes():
+    with encodes_lock:
+        return [encode.to_dict() for encode in active_encodes]
+
+
+def metric_labels(**labels):
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of queue, per-encode progress, totals and cache counters."""
+    with encodes_lock:
+        encodes = [encode.to_dict() for encode in active_encodes]
+        totals = dict(encode_totals)
+    with jobs_lock:
+        statuses = [job.status for job in jobs.values()]
+    cache_stats = cache.stats()
+    cpu = scheduler.stats()
+
+    lines = [
+        "# TYPE transcoder_workers gauge",
+        f"transcoder_workers {TRANSCODE_WORKERS}",
+        "# TYPE transcoder_jobs gauge",
+    ]
+    for status in ("queued", "running", "done", "failed", "cancelled"):
+        lines.append(f"transcoder_jobs{metric_labels(status=status)} {statuses.count(status)}")
+
+    gauges = [
+        ("transcoder_encode_fps", "fps"),
+        ("transcoder_encode_speed", "speed"),
+        ("transcoder_encode_bitrate_kbps", "bitrate_kbps"),
+        ("transcoder_encode_out_time_seconds", "out_time"),
+        ("transcoder_encode_progress_ratio", "progress"),
+        ("transcoder_encode_eta_seconds", "eta"),
+    ]
+    for name, field in gauges:
+        lines.append(f"# TYPE {name} gauge")
+        for encode in encodes:
+            if encode[field] is not None:
+                labels = metric_labels(job=encode["job_id"], filename=encode["filename"], stage=encode["stage"])
+                lines.append(f"{name}{labels} {encode[field]}")
+
+    lines.extend([
+        "# TYPE transcoder_ffmpeg_processes_total counter",
+        f"transcoder_ffmpeg_processes_total {totals['processes']}",
+        "# TYPE transcoder_ffmpeg_failures_total counter",
+        f"transcoder_ffmpeg_failures_total {totals['failed']}",
+        "# TYPE transcoder_ffmpeg_wall_seconds_total counter",
+        f"transcoder_ffmpeg_wall_seconds_total {totals['wall_seconds']}",
+        "# TYPE transcoder_ffmpeg_media_seconds_total counter",
+        f"transcoder_ffmpeg_media_seconds_total {totals['media_seconds']}",
+        "# TYPE transcoder_cache_hits_total counter",
+        f"transcoder_cache_hits_total {cache_stats['hits']}",
+        "# TYPE transcoder_cache_misses_total counter",
+        f"transcoder_cache_misses_total {cache_stats['misses']}",
+        "# TYPE transcoder_cache_evictions_total counter",
+        f"transcoder_cache_evictions_total {cache_stats['evictions']}",
+        "# TYPE transcoder_cache_bytes gauge",
+        f"transcoder_cache_bytes {cache_stats['bytes']}",
+        "# TYPE transcoder_cpu_cores gauge",
+        f"transcoder_cpu_cores {cpu['cores']}",
+        "# TYPE transcoder_encoder_threads_booked gauge",
+        f"transcoder_encoder_threads_booked {cpu['threads_booked']}",
+        "# TYPE transcoder_cpu_pressure gauge",
+        f"transcoder_cpu_pressure {cpu['pressure']}",
+    ])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
 
 @app.get("/")
 async def root():
@@ -185,15 +1932,35 @@ async def root():
 
 @app.get("/api-status")
 async def health():
+    with jobs_lock:
+        statuses = [job.status for job in jobs.values()]
+    queue_info = {
+        "workers": TRANSCODE_WORKERS,
+        "queued": statuses.count("queued"),
+        "running": statuses.count("running"),
+        "cpu": scheduler.stats(),
+    }
     try:
-        subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        subprocess.run(["ffprobe", "-version"], capture_output=True, check=True)
-        return {"status": "healthy", "ffmpeg": "available"}
+        await run_in_threadpool(subprocess.run, ["ffmpeg", "-version"], capture_output=True, check=True)
+        await run_in_threadpool(subprocess.run, ["ffprobe", "-version"], capture_output=True, check=True)
+        return {"status": "healthy", "ffmpeg": "available", "queue": queue_info}
     except (subprocess.CalledProcessError, FileNotFoundError):
-        return {"status": "unhealthy", "ffmpeg": "not available"}
+        return {"status": "unhealthy", "ffmpeg": "not available", "queue": queue_info}
+
+threading.Thread(target=sweep_expired, name="expiry", daemon=True).start()
 
 if __name__ == "__main__":
     import uvicorn
     print("Starting DASH Media Processor...")
+    print(f"Transcode workers: {TRANSCODE_WORKERS}, encoder threads budgeted over {CPU_CORES} cores")
     print("Send POST requests with media files to http://127.0.0.1:8000/process/")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    print("or stream a raw body to http://127.0.0.1:8000/process/stream/?filename=<name>")
+    print("Large files can be sent resumably: POST /uploads/?filename=&size=, PUT /uploads/<id>?offset=, "
+          "POST /uploads/<id>/finalize")
+    print("Add ?queue=true to /process/ to get a job id back and poll /jobs/<job_id>")
+    print("Add ?parallel=<N> to encode long sources as N ranges side by side")
+    print("Add ?hls=true to also write HLS playlists over the same CMAF segments")
+    print("Add ?adaptive=true to pick the rungs and bitrates per title (recorded in ladder.json)")
+    if LIVE_PUBLISH_ROOT:
+        print(f"Add ?live=true to publish into {LIVE_PUBLISH_ROOT} while encoding")
+    uvicorn.run(app, host="127.0.0.1", port=8000)